@@ -31,23 +31,29 @@ class CustomUserSerializer(djoser_serializers.UserSerializer):
         read_only_fields = (settings.LOGIN_FIELD, ) + additional_fields
     
     def get_event_registrations(self, obj):
-        queryset = EventRegistrations.objects.filter(
-            user=obj.id
-        ).order_by('-id')
+        queryset = getattr(obj, 'prefetched_event_registrations', None)
+        if queryset is None:
+            queryset = EventRegistrations.objects.filter(
+                user=obj.id
+            ).order_by('-id')
         serializer = EventRegistrationsSerializer(queryset, many=True)
         return serializer.data
     
     def get_private_event_registrations(self, obj):
-        queryset = PrivateEventRegistrations.objects.filter(
-            user=obj.id
-        ).order_by('-id')
+        queryset = getattr(obj, 'prefetched_private_event_registrations', None)
+        if queryset is None:
+            queryset = PrivateEventRegistrations.objects.filter(
+                user=obj.id
+            ).order_by('-id')
         serializer = PrivateEventRegistrationsSerializer(queryset, many=True)
         return serializer.data
     
     def get_paid_event_registrations(self, obj):
-        queryset = PaidEventRegistrations.objects.filter(
-            user=obj.id
-        ).order_by('-id')
+        queryset = getattr(obj, 'prefetched_paid_event_registrations', None)
+        if queryset is None:
+            queryset = PaidEventRegistrations.objects.filter(
+                user=obj.id
+            ).order_by('-id')
         serializer = PaidEventRegistrationsSerializer(queryset, many=True)
         return serializer.data
         
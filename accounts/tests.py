@@ -1,3 +1,120 @@
-from django.test import TestCase
+import warnings
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from events.models import (EventRegistrations, Events, PaidEventRegistrations,
+                           PaidEvents, PrivateEventRegistrations,
+                           PrivateEvents)
+
+
+class CustomUserViewSetTestCase(APITestCase):
+
+    users_list_url = reverse('user-list')
+    users_me_url = reverse('user-me')
+
+    def setUp(self):
+        self.admin_client = APIClient()
+        self.client = APIClient()
+
+        # Admin user | JWT Authorization
+        self.admin_user = get_user_model().objects.create_superuser(
+            username='admin@test.com',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        self.admin_token = AccessToken.for_user(self.admin_user)
+        self.admin_client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.admin_token}')
+
+        # Default user | JWT Authorization
+        self.user = get_user_model().objects.create(
+            username='user@test.com',
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.user_token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user_token}')
+
+        # Creating events
+        event_data = {
+            'start_datetime': timezone.now() + timedelta(days=1),
+            'closing_registration_date': timezone.now() + timedelta(hours=1)
+        }
+        self.event = Events.objects.create(name='Test event', **event_data)
+        self.private_event = PrivateEvents.objects.create(name='Test private event', **event_data)
+        self.paid_event = PaidEvents.objects.create(name='Test paid event', **event_data)
+
+        self.group = Group.objects.create(name='Test group')
+
+    def tearDown(self):
+        self.user.delete()
+        self.admin_user.delete()
+
+    def create_user_with_registrations(self, username):
+        user = get_user_model().objects.create(
+            username=username,
+            email=username,
+            password='testpass123'
+        )
+        user.groups.add(self.group)
+        EventRegistrations.objects.create(event=self.event, user=user, is_registration_confirmed=True)
+        PrivateEventRegistrations.objects.create(event=self.private_event, user=user, is_registration_confirmed=True)
+        PaidEventRegistrations.objects.create(event=self.paid_event, user=user)
+        return user
+
+    @override_settings(PAGINATION_COUNT_STRATEGY='exact')
+    def test_users_list_query_count(self):
+        self.create_user_with_registrations('user1@test.com')
+
+        with CaptureQueriesContext(connection) as few_users_queries:
+            response = self.admin_client.get(self.users_list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Количество запросов не должно зависеть от количества пользователей
+        for i in range(2, 11):
+            self.create_user_with_registrations(f'user{i}@test.com')
+
+        with CaptureQueriesContext(connection) as many_users_queries:
+            response = self.admin_client.get(self.users_list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(len(few_users_queries), len(many_users_queries))
+
+        user_data = next(user for user in response.data.get("results") if user.get("email") == 'user10@test.com')
+        self.assertEqual(user_data.get("groups"), [self.group.id])
+        self.assertEqual(len(user_data.get("event_registrations")), 1)
+        self.assertEqual(len(user_data.get("private_event_registrations")), 1)
+        self.assertEqual(len(user_data.get("paid_event_registrations")), 1)
+
+    def test_users_list_ordering(self):
+        users = [self.create_user_with_registrations(f'user{i}@test.com') for i in range(1, 4)]
+
+        # Пагинация списка пользователей детерминирована: новые пользователи первыми
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UnorderedObjectListWarning)
+            response = self.admin_client.get(self.users_list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [user.get("id") for user in response.data.get("results")],
+            [user.id for user in reversed(users)] + [self.user.id, self.admin_user.id]
+        )
+
+    def test_users_me_view(self):
+        EventRegistrations.objects.create(event=self.event, user=self.user, is_registration_confirmed=True)
+
+        response = self.client.get(self.users_me_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("id"), self.user.id)
+        self.assertEqual(len(response.data.get("event_registrations")), 1)
+        self.assertEqual(response.data.get("private_event_registrations"), [])
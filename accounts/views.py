@@ -1,14 +1,48 @@
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.db.models import Prefetch
+from djoser import views as djoser_views
 from rest_framework import viewsets
-from rest_framework.permissions import IsAdminUser
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
 
 from config.permissions import ReadOnly
+from events.models import (EventRegistrations, PaidEventRegistrations,
+                           PrivateEventRegistrations)
 
 from .serializers import GroupSerializer
 
 # ViewSets
 
+class CustomUserViewSet(djoser_views.UserViewSet):
+    """ Djoser users ViewSet with prefetched groups and event registrations """
+    
+    queryset = get_user_model().objects.prefetch_related(
+        'groups',
+        Prefetch(
+            'eventregistrations_set',
+            queryset=EventRegistrations.objects.order_by('-id'),
+            to_attr='prefetched_event_registrations'
+        ),
+        Prefetch(
+            'privateeventregistrations_set',
+            queryset=PrivateEventRegistrations.objects.order_by('-id'),
+            to_attr='prefetched_private_event_registrations'
+        ),
+        Prefetch(
+            'paideventregistrations_set',
+            queryset=PaidEventRegistrations.objects.order_by('-id'),
+            to_attr='prefetched_paid_event_registrations'
+        ),
+    ).order_by('-id')
+    
+    def get_instance(self):
+        # /users/me/ тоже отдается с подгруженными регистрациями
+        if self.request.method in SAFE_METHODS:
+            return self.get_queryset().get(pk=self.request.user.pk)
+        return super().get_instance()
+
+
 class GroupsViewSet(viewsets.ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
-    permission_classes = [ReadOnly | IsAdminUser, ]
\ No newline at end of file
+    permission_classes = [ReadOnly | IsAdminUser, ]
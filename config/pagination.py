@@ -1,12 +1,180 @@
+import hashlib
+from functools import partial
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework import pagination
 from rest_framework.response import Response
 
 
+class CountStrategyPage(Page):
+    has_next_page = None
+
+    def has_next(self):
+        if self.has_next_page is None:
+            return super().has_next()
+        return self.has_next_page
+
+
+class CountStrategyPaginator(Paginator):
+    """ Paginator with configurable count strategy (count_strategy argument,
+    PAGINATION_COUNT_STRATEGY setting by default):
+
+    1) exact - COUNT(*) on every request
+    2) cached - COUNT(*) is cached per count version and filter signature
+    3) estimated - Postgres planner estimate for unfiltered lists of large tables,
+    cached counts for the rest
+
+    get_count_version(model) returns the version of cached counts, which must change
+    on every write to the model, so cached counts are exact. Without it counts are not cached """
+
+    count_is_exact = True
+
+    def __init__(self, *args, count_strategy=None, get_count_version=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_strategy = count_strategy or getattr(settings, 'PAGINATION_COUNT_STRATEGY', 'exact')
+        self.get_count_version = get_count_version
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet) or self.count_strategy == 'exact':
+            return super().count
+
+        if self.count_strategy == 'estimated':
+            estimated_count = self.get_estimated_count()
+            if estimated_count is not None:
+                self.count_is_exact = False
+                return estimated_count
+
+        if self.get_count_version is None:
+            return super().count
+        return self.get_cached_count()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # При неточном кол-ве объектов страница может существовать за его пределами
+            if self.count_is_exact or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_is_exact:
+            return super().page(number)
+
+        # Страница не обрезается по неточному кол-ву объектов, 
+        # наличие следующей страницы определяется по лишнему объекту
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not object_list and number > 1:
+            raise EmptyPage("That page contains no results")
+
+        page = self._get_page(object_list[:self.per_page], number, self)
+        page.has_next_page = len(object_list) > self.per_page
+        return page
+
+    def _get_page(self, *args, **kwargs):
+        return CountStrategyPage(*args, **kwargs)
+
+    def get_cached_count(self):
+        """ Кол-во объектов из кэша (ключ зависит от версии кол-ва объектов модели и SQL запроса) """
+        queryset = self.object_list
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+
+        signature = hashlib.md5(f"{sql}:{params}".encode()).hexdigest()
+        model = queryset.model
+        cache_key = f"{model._meta.label_lower}:count:{self.get_count_version(model)}:{signature}"
+
+        # Версия меняется при каждом изменении модели, поэтому закэшированное кол-во точное
+        count = cache.get(cache_key)
+        if count is not None:
+            return count
+
+        count = queryset.count()
+        cache.set(cache_key, count, getattr(settings, 'PAGINATION_COUNT_CACHE_TIME', 60))
+        return count
+
+    def get_estimated_count(self):
+        """ Оценка кол-ва строк таблицы планировщиком Postgres (только для списков без фильтров) """
+        queryset = self.object_list
+        query = queryset.query
+        if (
+            connections[queryset.db].vendor != 'postgresql'
+            or query.where or query.distinct or query.combinator or query.is_sliced
+        ):
+            return None
+
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+
+        # Для небольших таблиц оценка неточна, а точный подсчет дешев
+        threshold = getattr(settings, 'PAGINATION_COUNT_ESTIMATE_THRESHOLD', 100000)
+        if row is None or row[0] < threshold:
+            return None
+        return row[0]
+
+
+class CustomCursorPagination(pagination.CursorPagination):
+    """ Keyset pagination without COUNT and OFFSET queries """
+
+    page_size_query_param = 'page_size'
+    ordering = '-id'
+
+    def get_paginated_response(self, data):
+        # Формат ответа как у CustomPagination, без подсчета кол-ва объектов
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'count': None,
+            'total_pages': None,
+            'current_page_number': None,
+            'page_size': self.page_size,
+            'count_is_exact': None,
+            'results': data
+        })
+
+
 class CustomPagination(pagination.PageNumberPagination):
+    """ Page number pagination, switches to cursor pagination when
+    cursor query parameter is passed (?cursor= for the first page).
+
+    Count strategy and version of cached counts are taken from the view
+    (pagination_count_strategy attribute and get_pagination_count_version method) """
+
     page_size_query_param = 'page_size'
+    django_paginator_class = CountStrategyPaginator
+    cursor_pagination_class = CustomCursorPagination
+    cursor_pagination = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_pagination_class.cursor_query_param in request.query_params:
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(queryset, request, view)
+        self.cursor_pagination = None
+        self.django_paginator_class = partial(
+            type(self).django_paginator_class,
+            count_strategy=getattr(view, 'pagination_count_strategy', None),
+            get_count_version=getattr(view, 'get_pagination_count_version', None),
+        )
+        return super().paginate_queryset(queryset, request, view)
 
     def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
         return Response({
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
@@ -14,5 +182,22 @@ class CustomPagination(pagination.PageNumberPagination):
             'total_pages': self.page.paginator.num_pages,
             'current_page_number': self.page.number,
             'page_size': self.page_size,
+            'count_is_exact': self.page.paginator.count_is_exact,
             'results': data
         })
+
+    def get_schema_fields(self, view):
+        fields = super().get_schema_fields(view)
+        field_names = {field.name for field in fields}
+        return fields + [
+            field for field in self.cursor_pagination_class().get_schema_fields(view)
+            if field.name not in field_names
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameter_names = {parameter['name'] for parameter in parameters}
+        return parameters + [
+            parameter for parameter in self.cursor_pagination_class().get_schema_operation_parameters(view)
+            if parameter['name'] not in parameter_names
+        ]
@@ -0,0 +1,152 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .qiwi import get_QIWI_p2p
+
+Bill = namedtuple('Bill', ('bill_id', 'status', 'pay_url'))
+
+
+def get_payment_provider():
+    """ Получение платежного провайдера из настройки PAYMENT_PROVIDER (None, если он не настроен) """
+    provider_class = import_string(getattr(settings, "PAYMENT_PROVIDER", "config.payments.QiwiPaymentProvider"))
+    return provider_class.get_instance()
+
+
+class PaymentProvider(ABC):
+    """ Payment provider interface.
+
+    Bill statuses are the same as QIWI ones: CREATED, WAITING, PAID, EXPIRED, REJECTED """
+
+    max_workers = getattr(settings, "PAYMENT_HANDLER_MAX_WORKERS", 8)
+
+    @classmethod
+    def get_instance(cls):
+        return cls()
+
+    @abstractmethod
+    def create_bill(self, bill_id, amount, lifetime, comment):
+        """ Создание счета на оплату (lifetime - время жизни счета в минутах) """
+
+    @abstractmethod
+    def check(self, bill_id):
+        """ Статус оплаты счета """
+
+    @abstractmethod
+    def reject(self, bill_id):
+        """ Отклонение счета """
+
+    def bulk_check(self, bill_ids, executor=None):
+        """ Статусы оплаты счетов {bill_id: status}, для счетов, которые не удалось проверить - исключение 
+        
+        Счета проверяются в пуле потоков executor (без него - в новом пуле на время вызова) """
+        def check(bill_id):
+            try:
+                return self.check(bill_id)
+            except Exception as error:
+                return error
+
+        bill_ids = list(bill_ids)
+        if executor is not None:
+            return dict(zip(bill_ids, executor.map(check, bill_ids)))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(bill_ids, executor.map(check, bill_ids)))
+
+
+class QiwiPaymentProvider(PaymentProvider):
+    """ QIWI p2p payment provider """
+
+    def __init__(self, p2p):
+        self.p2p = p2p
+
+    @classmethod
+    def get_instance(cls):
+        p2p = get_QIWI_p2p()
+        return cls(p2p) if p2p is not None else None
+
+    def create_bill(self, bill_id, amount, lifetime, comment):
+        bill = self.p2p.bill(bill_id=bill_id, amount=amount, lifetime=lifetime, comment=comment)
+        return Bill(bill_id, bill.status, bill.pay_url)
+
+    def check(self, bill_id):
+        return self.p2p.check(bill_id).status
+
+    def reject(self, bill_id):
+        return self.p2p.reject(bill_id).status
+
+
+class FakePaymentProvider(PaymentProvider):
+    """ In-process payment provider for tests and load testing.
+
+    Simulates API latency (FAKE_PAYMENT_PROVIDER_LATENCY seconds) and bill status
+    transitions: a bill is WAITING after the first check and PAID after
+    FAKE_PAYMENT_PROVIDER_PAY_AFTER_CHECKS checks (never, if None), unpaid bills expire
+    after their lifetime. Bills are shared by all instances in the process """
+
+    bills = {}
+
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.bills.clear()
+
+    @classmethod
+    def set_status(cls, bill_id, status):
+        """ Принудительный статус счета, не меняющийся при проверках (исключение - ошибка при проверке счета) """
+        with cls.lock:
+            bill = cls.bills.setdefault(bill_id, {'checks': 0, 'expires_at': None})
+            bill.update(status=status, forced=True)
+
+    def simulate_latency(self):
+        latency = getattr(settings, "FAKE_PAYMENT_PROVIDER_LATENCY", 0)
+        if latency:
+            time.sleep(latency)
+
+    def create_bill(self, bill_id, amount, lifetime, comment):
+        self.simulate_latency()
+        with self.lock:
+            self.bills[bill_id] = {
+                'status': 'CREATED',
+                'checks': 0,
+                'expires_at': timezone.now() + timedelta(minutes=int(lifetime)),
+            }
+        return Bill(bill_id, 'CREATED', f"https://fake-payments.local/bills/{bill_id}?amount={amount}")
+
+    def check(self, bill_id):
+        self.simulate_latency()
+        with self.lock:
+            bill = self.bills.get(bill_id)
+            if bill is None:
+                raise LookupError(f"Bill {bill_id} not found")
+            if isinstance(bill['status'], Exception):
+                raise bill['status']
+
+            bill['checks'] += 1
+            if not bill.get('forced') and bill['status'] in ('CREATED', 'WAITING'):
+                pay_after_checks = getattr(settings, "FAKE_PAYMENT_PROVIDER_PAY_AFTER_CHECKS", 2)
+                if bill['expires_at'] is not None and bill['expires_at'] <= timezone.now():
+                    bill['status'] = 'EXPIRED'
+                elif pay_after_checks is not None and bill['checks'] >= pay_after_checks:
+                    bill['status'] = 'PAID'
+                else:
+                    bill['status'] = 'WAITING'
+            return bill['status']
+
+    def reject(self, bill_id):
+        self.simulate_latency()
+        with self.lock:
+            bill = self.bills.get(bill_id)
+            if bill is None:
+                raise LookupError(f"Bill {bill_id} not found")
+            if bill['status'] != 'PAID':
+                bill.update(status='REJECTED', forced=True)
+            return bill['status']
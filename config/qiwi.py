@@ -1,18 +1,97 @@
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
 from django.conf import settings
 from extra_settings.models import Setting
 from pyqiwip2p import QiwiP2P
 
+logger = logging.getLogger(__name__)
+
+QIWI_private_key_cache_time = getattr(settings, "QIWI_PRIVATE_KEY_CACHE_TIME", 60)
+
+# Общие для процесса клиенты QIWI (по значению ключа), клиенты переиспользуют 
+# keep-alive соединения httpx. Ключ перечитывается из настроек не чаще раза в 
+# QIWI_PRIVATE_KEY_CACHE_TIME секунд и сразу после его изменения (events.signals)
+
+_QIWI_clients = {}
+
+_QIWI_private_key = None
+
+_QIWI_private_key_expires_at = 0
+
+_QIWI_clients_lock = threading.Lock()
+
+
+def get_QIWI_secret_key():
+    """ Получение приватного ключа QIWI (им же подписываются уведомления о счетах) """
+    global _QIWI_private_key, _QIWI_private_key_expires_at
+    
+    if _QIWI_private_key is not None and time.monotonic() < _QIWI_private_key_expires_at:
+        return _QIWI_private_key
+    
+    try:
+        private_key = Setting.get("QIWI_PRIVATE_KEY", default=None)
+    except Exception:
+        logger.exception("Failed to read QIWI_PRIVATE_KEY from admin settings")
+        private_key = None
+    private_key = private_key or getattr(settings, "QIWI_PRIVATE_KEY", "")
+    
+    _QIWI_private_key, _QIWI_private_key_expires_at = private_key, time.monotonic() + QIWI_private_key_cache_time
+    return private_key
+
 
 def get_QIWI_p2p():
     """ Получение объекта QIWI p2p для оплаты """
+    private_key = get_QIWI_secret_key()
+    if not private_key:
+        logger.warning("Set QIWI_PRIVATE_KEY setting in admin settings or setting files!")
+        return None
+    
+    with _QIWI_clients_lock:
+        if private_key not in _QIWI_clients:
+            try:
+                p2p = QiwiP2P(auth_key=private_key)
+                # HTTP клиент создается сразу, чтобы потоки не создавали его одновременно
+                p2p.client
+            except Exception:
+                logger.error("Invalid QIWI_PRIVATE_KEY setting, QIWI payments are disabled")
+                p2p = None
+            _QIWI_clients[private_key] = p2p
+        return _QIWI_clients[private_key]
+
+
+def clear_QIWI_clients():
+    """ Сброс клиентов QIWI и закэшированного ключа (после изменения настроек) """
+    global _QIWI_private_key
+    
+    # Клиенты не закрываются - ими могут пользоваться выполняющиеся запросы
+    with _QIWI_clients_lock:
+        _QIWI_clients.clear()
+        _QIWI_private_key = None
+
+
+def get_QIWI_notification_signature(bill, secret_key):
+    """ Подпись уведомления QIWI о счете (HMAC-SHA256 от "currency|value|billId|siteId|status") """
+    invoice_parameters = "|".join((
+        str(bill["amount"]["currency"]),
+        str(bill["amount"]["value"]),
+        str(bill["billId"]),
+        str(bill["siteId"]),
+        str(bill["status"]["value"]),
+    ))
+    return hmac.new(secret_key.encode(), invoice_parameters.encode(), hashlib.sha256).hexdigest()
+
+
+def is_valid_QIWI_notification(bill, signature):
+    """ Проверка подписи уведомления QIWI о счете """
+    secret_key = get_QIWI_secret_key()
+    if not secret_key or not signature:
+        return False
     try:
-        p2p = QiwiP2P(auth_key=Setting.get("QIWI_PRIVATE_KEY"))
-    except:
-        try:
-            print(
-                "\n[!] SET QIWI_PRIVATE_KEY SETTING IN ADMIN SETTINGS OR SETTING FILES!!!\n")
-            p2p = QiwiP2P(auth_key=settings.QIWI_PRIVATE_KEY)
-        except:
-            p2p = None
-
-    return p2p
\ No newline at end of file
+        expected_signature = get_QIWI_notification_signature(bill, secret_key)
+    except (KeyError, TypeError):
+        return False
+    return hmac.compare_digest(expected_signature, signature)
@@ -188,6 +188,16 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 12
 }
 
+# Подсчет кол-ва объектов при пагинации (config.pagination.CountStrategyPaginator): 
+# exact - COUNT(*) на каждый запрос, cached - кэширование COUNT(*), 
+# estimated - оценка Postgres для списков без фильтров и кэширование COUNT(*) для остальных. 
+# Кэширование используется только во view, которые задают версию кэша (get_pagination_count_version), 
+# в остальных - COUNT(*). Списки events.mixins.CachedModelMixin кэшируют кол-во и при exact: 
+# версия меняется при каждом изменении модели, поэтому закэшированное кол-во точное
+PAGINATION_COUNT_STRATEGY = 'exact'
+PAGINATION_COUNT_CACHE_TIME = 60
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = 100000
+
 
 # JWT Authentication settings
 
@@ -294,6 +304,16 @@ CACHES = {
 
 CACHING_TIME = 120
 
+# Время, в течение которого после CACHING_TIME отдаются устаревшие данные, пока один запрос их пересчитывает
+CACHING_STALE_TIME = 30
+
+# Коэффициент вероятностного раннего пересчета кэша (0 - выключен)
+CACHING_EARLY_REFRESH_BETA = 1.0
+
+# Время жизни блокировки пересчета и время ожидания пересчета другим запросом
+CACHING_LOCK_TIMEOUT = 10
+CACHING_LOCK_WAIT_TIME = 2
+
 # 'Extra settings' settings
 
 EXTRA_SETTINGS_ENFORCE_UPPERCASE_SETTINGS = True
@@ -332,8 +352,25 @@ QIWI_PRIVATE_KEY = ""
 
 QIWI_PAYMENTS_LIFETIME = 30
 
+# Как часто клиент QIWI перечитывает ключ из настроек (в сек)
+QIWI_PRIVATE_KEY_CACHE_TIME = 60
+
 SUCCESS_PAYMENT_URL = "http://127.0.0.1:8000/"
 
+# Создание счета на оплату в Celery задаче (регистрация возвращает 202, ссылка на оплату появляется позже)
+PAYMENT_BILL_CREATION_ASYNC = False
+
+# Задержка между попытками создания счета на оплату (в сек)
+PAYMENT_BILL_RETRY_DELAY = 10
+
+# Платежный провайдер (config.payments.FakePaymentProvider - локальная имитация для тестов и нагрузочного тестирования)
+PAYMENT_PROVIDER = 'config.payments.QiwiPaymentProvider'
+
+# Имитация задержки API (в сек) и кол-во проверок счета до его оплаты (None - счет не оплачивается) у FakePaymentProvider
+FAKE_PAYMENT_PROVIDER_LATENCY = 0
+
+FAKE_PAYMENT_PROVIDER_PAY_AFTER_CHECKS = 2
+
 
 # Celery settings
 
@@ -349,21 +386,55 @@ RESULT_BACKEND = REDIS_URL
 
 CACHE_BACKEND = 'django-cache'
 
+# Интервал запуска страховочной проверки платежей (в минутах, делитель 60), 
+# от него зависит максимальная задержка между проверками счета (PAYMENT_CHECK_MAX_DELAY)
+PAYMENT_CHECK_INTERVAL_MINUTES = 15
+
 CELERYBEAT_SCHEDULE = {
-    'payment_check_every_2_min': {
+    # Статусы оплаты приходят в уведомлениях QIWI, проверка - страховка от потерянных уведомлений
+    'payment_check_every_15_min': {
         'task': 'events.tasks.payment_handler',
-        'schedule': crontab(minute='*/2'), # every 2 minutes
+        'schedule': crontab(minute=f'*/{PAYMENT_CHECK_INTERVAL_MINUTES}'), # every 15 minutes
     },
     'send_registration_reminder_every_day': {
         'task': 'events.tasks.send_registration_reminder',
         'schedule': crontab(hour=9, minute=0), # every day at 9am
     },
+    # Передача задач из outbox в брокер
+    'relay_outbox_every_min': {
+        'task': 'events.tasks.relay_outbox_messages',
+        'schedule': crontab(minute='*/1'), # every minute
+    },
 }
 
 BEAT_SCHEDULE = CELERYBEAT_SCHEDULE
 
 NOTIFICATION_DAYS_BEFORE_EVENTS = (5, 3, 1)
 
+# Кол-во регистраций в одной задаче рассылки напоминаний
+REMINDER_CHUNK_SIZE = 500
+
+# Outbox: кол-во задач, передаваемых в брокер за раз, и передача задач сразу после коммита 
+# (True - обращение к брокеру при обработке запроса, False - только периодической задачей)
+OUTBOX_BATCH_SIZE = 100
+
+OUTBOX_RELAY_ON_COMMIT = False
+
+# Кол-во получателей в одной задаче уведомления об отмене мероприятия
+CANCELLATION_NOTIFICATION_CHUNK_SIZE = 500
+
+# Обработчик платежей: размер пачки регистраций и кол-во потоков для проверки счетов QIWI
+PAYMENT_HANDLER_CHUNK_SIZE = 500
+
+PAYMENT_HANDLER_MAX_WORKERS = 8
+
+# Задержка между проверками статуса оплаты (в секундах) удваивается после каждой проверки. 
+# Счета проверяются только при запуске payment_handler, поэтому максимальная задержка больше 
+# интервала запуска, иначе каждый неоплаченный счет проверяется при каждом запуске
+PAYMENT_CHECK_BASE_DELAY = 30
+
+PAYMENT_CHECK_MAX_DELAY = 4 * PAYMENT_CHECK_INTERVAL_MINUTES * 60
+
 
 # Email settings
 
@@ -375,4 +446,10 @@ EMAIL_PORT = '8025'
 
 EMAIL_HOST_USER = 'from@example.com'
 
-EMAIL_HOST_PASSWORD = None
\ No newline at end of file
+EMAIL_HOST_PASSWORD = None
+
+# Массовая рассылка: кол-во писем, отправляемых за раз через одно SMTP соединение, 
+# и ограничение скорости отправки (писем в секунду, None - без ограничения)
+EMAIL_CHUNK_SIZE = 100
+
+EMAIL_RATE_LIMIT = None
@@ -87,6 +87,11 @@ CELERYBEAT_SCHEDULE = {
         'task': 'events.tasks.send_registration_reminder',
         'schedule': crontab(minute='*/1'), #crontab(hour=9, minute=0), # every day at 9am
     },
+    # Передача задач из outbox в брокер
+    'relay_outbox_every_min': {
+        'task': 'events.tasks.relay_outbox_messages',
+        'schedule': crontab(minute='*/1'), # every minute
+    },
 }
 
 BEAT_SCHEDULE = CELERYBEAT_SCHEDULE
@@ -69,14 +69,20 @@ RESULT_BACKEND = REDIS_URL
 CACHE_BACKEND = 'django-cache'
 
 CELERYBEAT_SCHEDULE = {
-    'payment_check_every_2_min': {
+    # Статусы оплаты приходят в уведомлениях QIWI, проверка - страховка от потерянных уведомлений
+    'payment_check_every_15_min': {
         'task': 'events.tasks.payment_handler',
-        'schedule': crontab(minute='*/2'), # every 2 minutes
+        'schedule': crontab(minute=f'*/{PAYMENT_CHECK_INTERVAL_MINUTES}'), # every 15 minutes
     },
     'send_registration_reminder_every_day': {
         'task': 'events.tasks.send_registration_reminder',
         'schedule': crontab(hour=9, minute=0), # every day at 9am
     },
+    # Передача задач из outbox в брокер
+    'relay_outbox_every_min': {
+        'task': 'events.tasks.relay_outbox_messages',
+        'schedule': crontab(minute='*/1'), # every minute
+    },
 }
 
 BEAT_SCHEDULE = CELERYBEAT_SCHEDULE
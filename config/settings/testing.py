@@ -14,4 +14,6 @@ RESULT_BACKEND = 'db+sqlite:///results.sqlite'
 
 CELERY_TASK_ALWAYS_EAGER = True
 
-CELERY_TASK_EAGER_PROPAGATES = True
\ No newline at end of file
+CELERY_TASK_EAGER_PROPAGATES = True
+
+PAYMENT_PROVIDER = 'config.payments.FakePaymentProvider'
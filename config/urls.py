@@ -26,8 +26,9 @@ from filebrowser.sites import site as filebrowser_site
 from rest_framework import permissions, routers
 
 from events.views import (EventsViewSet, EventTypesViewSet, EventVenuesViewSet,
-                          PaidEventsViewSet, PrivateEventsViewSet)
-from accounts.views import GroupsViewSet
+                          PaidEventsViewSet, PrivateEventsViewSet,
+                          QiwiNotificationView)
+from accounts.views import CustomUserViewSet, GroupsViewSet
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -51,6 +52,10 @@ router.register(r'event_venues', EventVenuesViewSet)
 router.register(r'event_types', EventTypesViewSet)
 router.register(r'groups', GroupsViewSet)    
 
+# Auth router (заменяет UserViewSet из djoser.urls)
+auth_router = routers.SimpleRouter()
+auth_router.register(r'users', CustomUserViewSet)
+
 urlpatterns = [
     
     # TinyMCE URLS
@@ -85,9 +90,14 @@ urlpatterns = [
     # DRF URLS
     path('api/', include(router.urls)),
 
+    # Payment notifications URLS
+    path('api/payments/qiwi/notifications/', QiwiNotificationView.as_view(), name='qiwi-notifications'),
+
     # Auth URLS
     path('api/auth/', include('rest_framework.urls', namespace='rest_framework')),
 
+    path('api/auth/', include(auth_router.urls)),
+
     path('api/auth/', include('djoser.urls')),
 
     path('api/auth/', include('djoser.urls.jwt')),
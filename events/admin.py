@@ -4,8 +4,9 @@ from django.utils.html import format_html
 from filebrowser.base import FileObject
 
 from .models import (EventRegistrations, Events, EventTypes, EventVenues,
-                     PaidEventRegistrations, PaidEvents,
-                     PrivateEventRegistrations, PrivateEvents)
+                     OutboxMessages, PaidEventRegistrations, PaidEvents,
+                     PrivateEventRegistrations, PrivateEvents,
+                     SentReminders)
 
 
 class EventRegistrationsInline(admin.TabularInline):
@@ -38,7 +39,7 @@ class EventsAdmin(admin.ModelAdmin):
 
     @admin.display(description="Кол-во зарегестрированных посетителей")
     def visitors_list_len(self, obj):
-        return obj.visitors_len()
+        return obj.confirmed_visitors_count
 
     @admin.display(description="Изображение для мероприятия")
     def image_tag(self, obj):
@@ -73,4 +74,16 @@ class EventTypesAdmin(admin.ModelAdmin):
     list_filter = ("updated", "created")
     search_fields = ("name", )
 
+
+@admin.register(SentReminders)
+class SentRemindersAdmin(admin.ModelAdmin):
+    list_display = ("registration_type", "registration_id", "days_before", "created")
+    list_filter = ("registration_type", "days_before", "created")
+
+
+@admin.register(OutboxMessages)
+class OutboxMessagesAdmin(admin.ModelAdmin):
+    list_display = ("task_name", "created", "relay_error")
+    list_filter = ("task_name", "created", ("relay_error", admin.EmptyFieldListFilter))
+
 admin.site.register((EventRegistrations, PrivateEventRegistrations, PaidEventRegistrations))
\ No newline at end of file
@@ -0,0 +1,187 @@
+import hashlib
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+caching_time = getattr(settings, 'CACHING_TIME', 60)
+
+caching_stale_time = getattr(settings, 'CACHING_STALE_TIME', 30)
+
+caching_early_refresh_beta = getattr(settings, 'CACHING_EARLY_REFRESH_BETA', 1.0)
+
+caching_lock_timeout = getattr(settings, 'CACHING_LOCK_TIMEOUT', 10)
+
+caching_lock_wait_time = getattr(settings, 'CACHING_LOCK_WAIT_TIME', 2)
+
+caching_lock_wait_interval = 0.05
+
+
+# Object versions
+
+# Объекты кэшируются под ключом с версией объекта, при изменении объекта (events.signals)
+# версия меняется и старые записи в кэше становятся недоступны до истечения их срока.
+# Новая версия всегда отличается от предыдущих, поэтому версии тоже могут истекать
+
+def get_version_key(model, pk):
+    return f"{model._meta.label_lower}:{pk}:version"
+
+
+def get_object_cache_key(model, pk, version, prefix=""):
+    return f"{model._meta.label_lower}:{pk}:{version}:{prefix}"
+
+
+def new_version():
+    return time.time_ns()
+
+
+def get_object_versions(model, pks):
+    """ Получение версий объектов модели {pk: version} """
+    version_keys = {get_version_key(model, pk): pk for pk in pks}
+    versions = cache.get_many(version_keys.keys())
+    for version_key in version_keys.keys() - versions.keys():
+        # add не перезапишет версию, выставленную параллельным запросом
+        cache.add(version_key, new_version(), caching_time)
+        versions[version_key] = cache.get(version_key)
+    return {pk: versions[version_key] for version_key, pk in version_keys.items()}
+
+
+def bump_object_versions(model, pks):
+    cache.set_many({get_version_key(model, pk): new_version() for pk in pks}, caching_time)
+
+
+def invalidate_objects(model, pks):
+    """ Инвалидация кэша объектов модели.
+
+    Версии меняются сразу и повторно после коммита транзакции, чтобы параллельный
+    запрос не закэшировал еще не закоммиченные данные под новой версией """
+    pks = list(pks)
+    if not pks:
+        return
+    bump_object_versions(model, pks)
+    transaction.on_commit(lambda: bump_object_versions(model, pks))
+
+
+# List generations
+
+# Ключ кэша страниц списка содержит поколение модели, которое меняется при любой записи
+# в модель, поэтому все закэшированные комбинации фильтров и страниц устаревают сразу
+
+def get_generation_key(model):
+    return f"{model._meta.label_lower}:generation"
+
+
+def get_list_cache_key(model, generation, full_path, prefix=""):
+    full_path_hash = hashlib.md5(full_path.encode()).hexdigest()
+    return f"{model._meta.label_lower}:list:{generation}:{full_path_hash}:{prefix}"
+
+
+def get_generation(model):
+    generation_key = get_generation_key(model)
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, new_version(), caching_time)
+        generation = cache.get(generation_key)
+    return generation
+
+
+def get_generation_datetime(generation):
+    """ Время смены поколения (поколение - время его создания в наносекундах, см. new_version) """
+    return datetime.fromtimestamp(generation / 10 ** 9, tz=timezone.utc)
+
+
+def bump_generation(model):
+    cache.set(get_generation_key(model), new_version(), caching_time)
+
+
+def invalidate_lists(model):
+    """ Инвалидация кэша всех страниц списка объектов модели """
+    bump_generation(model)
+    transaction.on_commit(lambda: bump_generation(model))
+
+
+# Stampede protection
+
+# Значение хранится вместе со временем устаревания и временем его вычисления.
+# Пересчитывает значение только процесс, получивший блокировку ключа, остальные 
+# отдают устаревшее значение (stale-while-revalidate) или ждут пересчета. 
+# Незадолго до устаревания значение может быть пересчитано заранее (XFetch)
+
+def get_lock_key(key):
+    return f"{key}:lock"
+
+
+def acquire_lock(key):
+    return cache.add(get_lock_key(key), True, caching_lock_timeout)
+
+
+def release_locks(keys):
+    cache.delete_many([get_lock_key(key) for key in keys])
+
+
+def needs_refresh(expires_at, compute_time, now):
+    """ Устарело ли значение или пора ли пересчитать его заранее """
+    early_refresh = compute_time * caching_early_refresh_beta * -math.log(1.0 - random.random())
+    return now + early_refresh >= expires_at
+
+
+def compute_and_set(keys, compute_many, timeout):
+    started = time.time()
+    try:
+        values = compute_many(keys)
+        compute_time = time.time() - started
+        expires_at = time.time() + timeout
+        cache.set_many(
+            {key: (value, expires_at, compute_time) for key, value in values.items()},
+            timeout + caching_stale_time
+        )
+    finally:
+        release_locks(keys)
+    return values
+
+
+def get_many_or_compute(keys, compute_many, timeout=caching_time):
+    """ Получение значений {key: value} из кэша с защитой от одновременного пересчета
+
+    compute_many(keys) - вычисление значений {key: value} для ключей, которых нет в кэше 
+    (ключи, для которых значение не вычислено, отсутствуют в результате) """
+    now = time.time()
+    entries = cache.get_many(keys)
+    values, keys_to_compute, keys_to_wait = {}, [], []
+
+    for key in keys:
+        entry = entries.get(key)
+        if entry is not None:
+            value, expires_at, compute_time = entry
+            values[key] = value
+            if needs_refresh(expires_at, compute_time, now) and acquire_lock(key):
+                keys_to_compute.append(key)
+        elif acquire_lock(key):
+            keys_to_compute.append(key)
+        else:
+            keys_to_wait.append(key)
+
+    if keys_to_compute:
+        values.update(compute_and_set(keys_to_compute, compute_many, timeout))
+
+    # Значения, которые пересчитывает другой процесс
+    wait_until = time.time() + caching_lock_wait_time
+    while keys_to_wait and time.time() < wait_until:
+        time.sleep(caching_lock_wait_interval)
+        entries = cache.get_many(keys_to_wait)
+        values.update({key: entry[0] for key, entry in entries.items()})
+        keys_to_wait = [key for key in keys_to_wait if key not in entries]
+
+    if keys_to_wait:
+        values.update(compute_many(keys_to_wait))
+
+    return values
+
+
+def get_or_compute(key, compute, timeout=caching_time):
+    """ Получение значения из кэша с защитой от одновременного пересчета """
+    return get_many_or_compute([key], lambda keys: {key: compute()}, timeout).get(key)
@@ -0,0 +1,47 @@
+import warnings
+
+from django.db import models
+from django.db.backends.ddl_references import Columns, Statement, Table
+
+
+def has_trigram_extension(connection):
+    """ Установлено ли расширение pg_trgm в текущей бд Postgres """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+class NameSearchIndex(models.Index):
+    """ Index for case-insensitive name lookups (name__iexact, name__icontains)
+
+    PostgreSQL: GIN index on UPPER(name) with pg_trgm operators, the same expression Django uses for
+    the lookups. Without pg_trgm a B-tree index on UPPER(name) is created, which serves only iexact.
+    SQLite: index on name COLLATE NOCASE, which serves iexact (case-insensitive LIKE without wildcards).
+    """
+
+    postgres_trigram_template = 'CREATE INDEX%(concurrently)s %(name)s ON %(table)s USING gin (UPPER(%(columns)s) gin_trgm_ops)'
+    postgres_template = 'CREATE INDEX%(concurrently)s %(name)s ON %(table)s (UPPER(%(columns)s))'
+    sqlite_template = 'CREATE INDEX %(name)s ON %(table)s (%(columns)s COLLATE NOCASE)'
+
+    def create_sql(self, model, schema_editor, using="", concurrently=False, **kwargs):
+        vendor = schema_editor.connection.vendor
+        if vendor == "postgresql":
+            if has_trigram_extension(schema_editor.connection):
+                template = self.postgres_trigram_template
+            else:
+                warnings.warn(f"pg_trgm extension is not installed, {self.name} is created without trigrams")
+                template = self.postgres_template
+        elif vendor == "sqlite":
+            template = self.sqlite_template
+        else:
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+        table = Table(model._meta.db_table, schema_editor.quote_name)
+        column = model._meta.get_field(self.fields[0]).column
+        return Statement(
+            template,
+            table=table,
+            name=schema_editor.quote_name(self.name),
+            columns=Columns(table.table, [column], schema_editor.quote_name),
+            concurrently=" CONCURRENTLY" if concurrently else "",
+        )
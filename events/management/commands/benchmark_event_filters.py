@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from events.models import Events
+
+words = ("Python", "Django", "Хакатон", "Митап", "Конференция", "Воркшоп", "Лекция", "Meetup", "Backend", "Frontend")
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет время фильтрации списка мероприятий (EventsViewSet.filterset_fields) "
+        "на сгенерированных мероприятиях. Данные удаляются после замера"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=1_000_000, help="Кол-во генерируемых мероприятий")
+        parser.add_argument("--batch-size", type=int, default=10_000, help="Размер пачки при генерации")
+        parser.add_argument("--repeat", type=int, default=5, help="Кол-во замеров каждого фильтра")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_events(options["events"], options["batch_size"])
+            for name, queryset in self.get_filters(options["events"]):
+                self.benchmark(name, queryset, options["repeat"])
+            # Сгенерированные мероприятия не сохраняются
+            transaction.set_rollback(True)
+
+    def create_events(self, count, batch_size):
+        now = timezone.now()
+        started = time.monotonic()
+        for start in range(0, count, batch_size):
+            Events.objects.bulk_create([
+                Events(
+                    name=f"{random.choice(words)} №{i:07}",
+                    start_datetime=now + timedelta(minutes=random.randrange(365 * 24 * 60)),
+                    closing_registration_date=now + timedelta(minutes=random.randrange(365 * 24 * 60)),
+                    duration=timedelta(minutes=random.randrange(30, 8 * 60, 30)),
+                )
+                for i in range(start, min(start + batch_size, count))
+            ])
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE "{Events._meta.db_table}"')
+        self.stdout.write(f"Создано мероприятий: {count} за {time.monotonic() - started:.1f} с")
+
+    def get_filters(self, count):
+        now = timezone.now()
+        events = Events.objects.order_by("-id")
+        return (
+            ("name__icontains (редкое значение)", events.filter(name__icontains=f"№{count // 2:07}")),
+            ("name__icontains (частое значение)", events.filter(name__icontains="python")),
+            ("start_datetime__gte/lte (1 день)", events.filter(
+                start_datetime__gte=now + timedelta(days=100), start_datetime__lte=now + timedelta(days=101)
+            )),
+            ("closing_registration_date__gte/lte (1 день)", events.filter(
+                closing_registration_date__gte=now + timedelta(days=200),
+                closing_registration_date__lte=now + timedelta(days=201)
+            )),
+            ("duration__gte (от 7.5 часов)", events.filter(duration__gte=timedelta(hours=7, minutes=30))),
+        )
+
+    def benchmark(self, name, queryset, repeat):
+        """ Медианное время подсчета кол-ва и получения первой страницы (как в CustomPagination) """
+        timings = []
+        for _ in range(repeat):
+            started = time.monotonic()
+            count = queryset.count()
+            list(queryset[:10])
+            timings.append((time.monotonic() - started) * 1000)
+
+        plan = queryset.explain().splitlines()
+        self.stdout.write(
+            f"{name}: {statistics.median(timings):.1f} мс (найдено {count})\n"
+            + "\n".join(f"    {line}" for line in plan)
+        )
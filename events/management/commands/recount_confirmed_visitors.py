@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from events.models import (EventRegistrations, Events, PaidEventRegistrations,
+                           PaidEvents, PrivateEventRegistrations,
+                           PrivateEvents)
+
+
+def confirmed_visitors_count_subquery(registration_model):
+    """ Подзапрос с количеством подтвержденных регистраций на мероприятие """
+    return Coalesce(Subquery(
+        registration_model.objects.filter(
+            registration_model.confirmed_visitor_filter,
+            event=OuterRef('pk')
+        ).order_by().values('event').annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счетчики подтвержденных посетителей всех мероприятий"
+
+    def handle(self, *args, **options):
+        for event_model, registration_model in (
+            (Events, EventRegistrations),
+            (PrivateEvents, PrivateEventRegistrations),
+            (PaidEvents, PaidEventRegistrations),
+        ):
+            updated = event_model.objects.update(
+                confirmed_visitors_count=confirmed_visitors_count_subquery(registration_model)
+            )
+            self.stdout.write(f"{event_model._meta.verbose_name_plural}: пересчитано {updated}")
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_confirmed_visitors(apps, schema_editor):
+    for event_model_name, registration_model_name, confirmed_filter in (
+        ("Events", "EventRegistrations", {}),
+        ("PrivateEvents", "PrivateEventRegistrations", {}),
+        ("PaidEvents", "PaidEventRegistrations", {"payment_status": "PAID"}),
+    ):
+        event_model = apps.get_model("events", event_model_name)
+        registration_model = apps.get_model("events", registration_model_name)
+        confirmed_visitors = (
+            registration_model.objects.filter(
+                event=OuterRef("pk"), is_registration_confirmed=True, **confirmed_filter
+            )
+            .order_by()
+            .values("event")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        event_model.objects.update(
+            confirmed_visitors_count=Coalesce(Subquery(confirmed_visitors), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0025_alter_events_visitors_alter_paidevents_visitors_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="events",
+            name="confirmed_visitors_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Кол-во подтвержденных посетителей",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paidevents",
+            name="confirmed_visitors_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Кол-во подтвержденных посетителей",
+            ),
+        ),
+        migrations.AddField(
+            model_name="privateevents",
+            name="confirmed_visitors_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Кол-во подтвержденных посетителей",
+            ),
+        ),
+        migrations.RunPython(recount_confirmed_visitors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0026_events_confirmed_visitors_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="eventregistrations",
+            name="waitlist_position",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Позиция в листе ожидания"
+            ),
+        ),
+        migrations.AddField(
+            model_name="paideventregistrations",
+            name="waitlist_position",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Позиция в листе ожидания"
+            ),
+        ),
+        migrations.AddField(
+            model_name="privateeventregistrations",
+            name="waitlist_position",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Позиция в листе ожидания"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="eventregistrations",
+            index=models.Index(
+                fields=["event", "waitlist_position"], name="event_waitlist_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paideventregistrations",
+            index=models.Index(
+                fields=["event", "waitlist_position"], name="paid_event_waitlist_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateeventregistrations",
+            index=models.Index(
+                fields=["event", "waitlist_position"], name="private_event_waitlist_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0027_eventregistrations_waitlist_position"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paideventregistrations",
+            name="next_check_at",
+            field=models.DateTimeField(
+                blank=True,
+                null=True,
+                verbose_name="Дата следующей проверки статуса оплаты",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paideventregistrations",
+            name="payment_check_attempts",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Кол-во проверок статуса оплаты"
+            ),
+        ),
+        migrations.AddField(
+            model_name="paideventregistrations",
+            name="payment_expires_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Дата истечения счета на оплату"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paideventregistrations",
+            index=models.Index(
+                fields=["payment_status", "next_check_at"],
+                name="paid_payment_check_idx",
+            ),
+        ),
+    ]
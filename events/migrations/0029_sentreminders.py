@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0028_paideventregistrations_payment_checks"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SentReminders",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "registration_type",
+                    models.CharField(
+                        choices=[
+                            ("EVENT", "Регистрация на мероприятие"),
+                            ("PRIVATE", "Регистрация на приватное мероприятие"),
+                            ("PAID", "Регистрация на платное мероприятие"),
+                        ],
+                        max_length=10,
+                        verbose_name="Тип регистрации",
+                    ),
+                ),
+                (
+                    "registration_id",
+                    models.PositiveBigIntegerField(verbose_name="ID регистрации"),
+                ),
+                (
+                    "days_before",
+                    models.PositiveSmallIntegerField(
+                        verbose_name="За сколько дней до мероприятия отправлено напоминание"
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата отправки напоминания"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "отправленное напоминание",
+                "verbose_name_plural": "Отправленные напоминания",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="sentreminders",
+            constraint=models.UniqueConstraint(
+                fields=("registration_type", "registration_id", "days_before"),
+                name="sent_reminder_unique",
+            ),
+        ),
+    ]
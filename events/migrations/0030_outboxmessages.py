@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0029_sentreminders"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxMessages",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "task_name",
+                    models.CharField(max_length=255, verbose_name="Название задачи"),
+                ),
+                (
+                    "kwargs",
+                    models.JSONField(
+                        blank=True, default=dict, verbose_name="Аргументы задачи"
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания сообщения"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "сообщение outbox",
+                "verbose_name_plural": "Сообщения outbox",
+                "ordering": ("id",),
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0030_outboxmessages"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="paideventregistrations",
+            name="paid_payment_check_idx",
+        ),
+        migrations.AddIndex(
+            model_name="eventregistrations",
+            index=models.Index(
+                fields=["event", "is_registration_confirmed"],
+                name="event_confirmed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="eventregistrations",
+            index=models.Index(fields=["user", "-id"], name="event_user_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="paideventregistrations",
+            index=models.Index(
+                fields=["event", "is_registration_confirmed", "payment_status"],
+                name="paid_event_confirmed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paideventregistrations",
+            index=models.Index(fields=["user", "-id"], name="paid_event_user_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="paideventregistrations",
+            index=models.Index(
+                condition=models.Q(("payment_status__in", ("CREATED", "WAITING"))),
+                fields=["next_check_at", "id"],
+                name="paid_pending_payment_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateeventregistrations",
+            index=models.Index(
+                fields=["event", "is_registration_confirmed"],
+                name="private_event_confirmed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateeventregistrations",
+            index=models.Index(fields=["user", "-id"], name="private_event_user_idx"),
+        ),
+    ]
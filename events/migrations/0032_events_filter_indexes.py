@@ -0,0 +1,94 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:18
+
+import warnings
+
+from django.db import DatabaseError, migrations, models, transaction
+
+import events.indexes
+
+
+def create_trigram_extension(apps, schema_editor):
+    # Триграммный NameSearchIndex создается только при установленном pg_trgm. Расширение доверенное 
+    # (Postgres 13+), но роли без права CREATE на бд его не создать: ошибка откатывается до точки 
+    # сохранения, и индексы по названию создаются без триграмм (см. NameSearchIndex)
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError as error:
+        warnings.warn(f"pg_trgm extension cannot be created: {error}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0031_registrations_hot_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_extension, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="events",
+            index=models.Index(fields=["start_datetime"], name="events_start_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="events",
+            index=models.Index(
+                fields=["closing_registration_date"], name="events_closing_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="events",
+            index=models.Index(fields=["duration"], name="events_duration_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="paidevents",
+            index=models.Index(fields=["start_datetime"], name="paidevents_start_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="paidevents",
+            index=models.Index(
+                fields=["closing_registration_date"], name="paidevents_closing_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paidevents",
+            index=models.Index(fields=["duration"], name="paidevents_duration_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="privateevents",
+            index=models.Index(
+                fields=["start_datetime"], name="privateevents_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateevents",
+            index=models.Index(
+                fields=["closing_registration_date"],
+                name="privateevents_closing_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateevents",
+            index=models.Index(fields=["duration"], name="privateevents_duration_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="events",
+            index=events.indexes.NameSearchIndex(
+                fields=["name"], name="events_name_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paidevents",
+            index=events.indexes.NameSearchIndex(
+                fields=["name"], name="paidevents_name_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateevents",
+            index=events.indexes.NameSearchIndex(
+                fields=["name"], name="privateevents_name_search_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0032_events_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmessages",
+            name="relay_error",
+            field=models.TextField(
+                blank=True,
+                null=True,
+                verbose_name="Ошибка передачи задачи (сообщение не передается, пока ошибка не очищена)",
+            ),
+        ),
+    ]
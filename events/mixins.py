@@ -1,16 +1,165 @@
+import hashlib
+
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from extra_settings.models import Setting
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 
-from config.qiwi import get_QIWI_p2p
+from config.payments import get_payment_provider
 
+from .cache import (get_generation, get_generation_datetime,
+                    get_list_cache_key, get_many_or_compute,
+                    get_object_cache_key, get_object_versions, get_or_compute)
+from .outbox import enqueue_task
 from .serializers import (EventInvitationsSerializer,
                           PrivateEventsCodeInvitationsSerializer)
+from .tasks import create_bill, create_registration_bill
+
+
+class CachedModelMixin:
+    """ Adds caching of serialized objects to list and retrieve actions.
+    
+    Cached objects are shared between all users, user specific data
+    is added to them by add_user_fields method. 
+    
+    Responses carry ETag and Last-Modified headers built from last_modified_field 
+    of cached objects (Last-Modified of lists is the list generation time), 
+    conditional requests are answered with 304 """
+    
+    last_modified_field = 'updated'
+    
+    @property
+    def pagination_count_strategy(self):
+        # Кол-во объектов кэшируется до изменения поколения списка, поэтому остается точным и заменяет 
+        # COUNT(*) на каждый запрос, но не оценку кол-ва (config.pagination.CountStrategyPaginator)
+        count_strategy = getattr(settings, 'PAGINATION_COUNT_STRATEGY', 'exact')
+        return 'cached' if count_strategy == 'exact' else count_strategy
+    
+    def get_pagination_count_version(self, model):
+        return get_generation(model)
+    
+    def get_cache_prefix(self):
+        # Ссылки на файлы в ответе зависят от хоста запроса
+        return self.request.build_absolute_uri('/')
+    
+    def get_cached_representations(self, pks):
+        """ Получение сериализованных объектов по их ID (недостающие в кэше берутся из бд) """
+        model = self.queryset.model
+        prefix = self.get_cache_prefix()
+        versions = get_object_versions(model, pks)
+        cache_keys = {pk: get_object_cache_key(model, pk, versions[pk], prefix) for pk in pks}
+        
+        def get_representations(keys):
+            pks_by_key = {cache_keys[pk]: pk for pk in pks}
+            instances = list(self.get_queryset().filter(pk__in=[pks_by_key[key] for key in keys]))
+            serializer = self.get_serializer(instances, many=True)
+            return {cache_keys[instance.pk]: data for instance, data in zip(instances, serializer.data)}
+        
+        # Объекты, которых нет в кэше, пересчитывает только один запрос
+        representations = get_many_or_compute(list(cache_keys.values()), get_representations)
+        return [representations[cache_keys[pk]] for pk in pks if cache_keys[pk] in representations]
+    
+    def add_user_fields(self, data):
+        """ Добавление данных текущего пользователя к общим данным из кэша """
+        return data
+    
+    def get_cached_page(self, generation):
+        """ Получение ID объектов страницы и данных пагинации (generation - поколение списка) """
+        model = self.queryset.model
+        cache_key = get_list_cache_key(
+            model, generation, self.request.get_full_path(), self.get_cache_prefix()
+        )
+        
+        def get_page():
+            # Из бд выбираются только ID объектов страницы, сами объекты берутся из кэша
+            queryset = self.filter_queryset(self.get_queryset())
+            queryset = queryset.select_related(None).prefetch_related(None).only('pk')
+            
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                pks = [instance.pk for instance in page]
+                return {'pks': pks, 'pagination': self.get_paginated_response(pks).data}
+            return {'pks': [instance.pk for instance in queryset], 'pagination': None}
+        
+        # Страницу пересчитывает только один запрос, остальные ждут или получают устаревшую
+        return get_or_compute(cache_key, get_page)
+    
+    def get_user_etag_key(self):
+        """ Часть ETag, зависящая от текущего пользователя (см. add_user_fields) """
+        return ""
+    
+    def get_validators(self, data, *etag_parts):
+        """ ETag и Last-Modified по дате изменения объектов из кэша """
+        updated = [item[self.last_modified_field] for item in data if item.get(self.last_modified_field)]
+        last_modified = max((parse_datetime(value) for value in updated), default=None)
+        
+        etag_source = repr(([item.get('id') for item in data], updated, etag_parts, self.get_user_etag_key()))
+        etag = quote_etag(hashlib.md5(etag_source.encode()).hexdigest())
+        return etag, last_modified
+    
+    def conditional_response(self, data, get_response, *etag_parts, last_modified=None):
+        """ Ответ 304, если данные не изменились, иначе get_response(data) 
+        (last_modified - дата изменения вместо даты изменения объектов из кэша) """
+        etag, objects_last_modified = self.get_validators(data, *etag_parts)
+        last_modified = last_modified or objects_last_modified
+        response = get_conditional_response(
+            self.request, etag=etag, 
+            last_modified=int(last_modified.timestamp()) if last_modified else None
+        )
+        if response is None:
+            response = get_response(data)
+        
+        response.headers['ETag'] = etag
+        if last_modified:
+            response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_vary_headers(response, ('Authorization', ))
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        generation = get_generation(self.queryset.model)
+        cached_page = self.get_cached_page(generation)
+        
+        def get_response(data):
+            data = self.add_user_fields(data)
+            if cached_page['pagination'] is not None:
+                return Response({**cached_page['pagination'], 'results': data})
+            return Response(data)
+        
+        # Удаление объекта не меняет дату изменения оставшихся, поэтому Last-Modified списка - 
+        # время смены поколения, которое меняется при любой записи в модель
+        return self.conditional_response(
+            self.get_cached_representations(cached_page['pks']), get_response, cached_page['pagination'],
+            last_modified=get_generation_datetime(generation)
+        )
+    
+    def get_object_pk(self):
+        """ ID объекта из запроса с проверками get_object (queryset, фильтры, права на объект) 
+        без загрузки остальных полей объекта """
+        queryset = self.filter_queryset(self.get_queryset()).select_related(None).prefetch_related(None).only('pk')
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance.pk
+    
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.get_object_pk()
+        data = self.get_cached_representations([pk])
+        if not data:
+            raise Http404
+        return self.conditional_response(data, lambda data: Response(self.add_user_fields(data)[0]))
 
 
 class RegistrationModelMixin:
@@ -25,6 +174,43 @@ class RegistrationModelMixin:
     
     permission_classes=[IsAuthenticated, ]
     
+    def lock_event(self, pk):
+        """ Блокирует строку мероприятия до конца текущей транзакции """
+        return get_object_or_404(self.queryset.model.objects.select_for_update(), pk=pk)
+    
+    def get_occupied_places(self, event):
+        """ Кол-во занятых мест на мероприятие """
+        return self.event_registration_model.get_occupied_places(event)
+    
+    def add_user_fields(self, data):
+        # Регистрация текущего пользователя не кэшируется вместе с мероприятием
+        user = self.request.user
+        registrations = {}
+        if user.is_authenticated and data:
+            registrations = {
+                registration.event_id: self.event_registration_serializer_class(registration).data
+                for registration in self.event_registration_model.objects.filter(
+                    user=user.id, event__in=[item['id'] for item in data]
+                )
+            }
+        return [
+            {**item, 'current_user_registration': registrations.get(item['id'])} for item in data
+        ]
+    
+    def get_user_etag_key(self):
+        # Изменения регистраций обновляют дату изменения мероприятия (events.signals)
+        return self.request.user.pk if self.request.user.is_authenticated else ""
+    
+    def event_is_full_response(self):
+        return Response({"error": "Все места на мероприятие заняты"}, status=status.HTTP_409_CONFLICT)
+    
+    def get_next_waitlist_position(self, event):
+        """ Следующая позиция в листе ожидания мероприятия """
+        last_position = self.event_registration_model.objects.filter(
+            event=event
+        ).aggregate(last_position=Max('waitlist_position'))['last_position']
+        return (last_position or 0) + 1
+    
     @action(detail=True, methods=['post'], serializer_class=Serializer, permission_classes=permission_classes)
     def registration(self, request, pk=None):
         """ Зарегестрироваться на конкретное мероприятие пользователю или группе пользователей """
@@ -35,7 +221,19 @@ class RegistrationModelMixin:
             "is_registration_confirmed": True,
         })
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        
+        # Проверка и запись выполняются под блокировкой мероприятия
+        with transaction.atomic():
+            event = self.lock_event(pk)
+            if event.is_full(self.get_occupied_places(event)):
+                # Если мест нет - регистрация встает в конец листа ожидания
+                serializer.save(
+                    is_registration_confirmed=False,
+                    waitlist_position=self.get_next_waitlist_position(event)
+                )
+                return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+            self.perform_create(serializer)
+        
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
@@ -43,8 +241,11 @@ class RegistrationModelMixin:
     def delete_registration(self, request, pk=None):
         """ Удалить регистрацию на конкретное мероприятие пользователю или группе пользователей """
         current_user = request.user
-        event_registration = get_object_or_404(self.event_registration_model, event=pk, user=current_user.id)
-        event_registration.delete()
+        with transaction.atomic():
+            event = self.lock_event(pk)
+            event_registration = get_object_or_404(self.event_registration_model, event=pk, user=current_user.id)
+            # Освободившееся место занимает первый в листе ожидания (см. events.signals)
+            event_registration.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     
 
@@ -82,6 +283,7 @@ class InvitationModelMixin(RegistrationModelMixin):
             event=pk, 
             inviting_user=current_user.id,
             is_registration_confirmed=False,
+            waitlist_position__isnull=True,
         )
         event_registration.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -95,6 +297,7 @@ class InvitationModelMixin(RegistrationModelMixin):
             event=pk, 
             user=current_user.id,
             is_registration_confirmed=False,
+            waitlist_position__isnull=True,
         )
         serializer = self.event_registration_serializer_class(
             instance,
@@ -102,7 +305,13 @@ class InvitationModelMixin(RegistrationModelMixin):
             partial=True
         )
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        
+        with transaction.atomic():
+            event = self.lock_event(pk)
+            if event.is_full(self.get_occupied_places(event)):
+                return self.event_is_full_response()
+            self.perform_update(serializer)
+        
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'], permission_classes=invitation_permission_classes)
@@ -155,13 +364,21 @@ class PaymentRegistrationModelMixin(RegistrationModelMixin):
     
     permission_classes=[IsAuthenticated, ]
     
+    def is_payment_async(self):
+        """ Создается ли счет на оплату в Celery задаче, а не в запросе """
+        return getattr(settings, "PAYMENT_BILL_CREATION_ASYNC", False)
+    
+    def create_payment(self, provider, paid_registration, event):
+        """ Создание счета на оплату регистрации """
+        create_bill(provider, paid_registration, event)
+    
     @action(detail=True, methods=['post'], serializer_class=Serializer, permission_classes=permission_classes)
     def registration(self, request, pk=None):
 
-        p2p = get_QIWI_p2p()
+        provider = get_payment_provider()
 
-        # Если ключа QIWI нет или он не прошел проверку
-        if p2p == None:
+        # Если платежный провайдер не настроен (ключа QIWI нет или он не прошел проверку)
+        if provider == None:
             return Response({"error": "Set QIWI_PRIVATE_KEY setting!"}, status=status.HTTP_400_BAD_REQUEST)
         
         current_user = request.user
@@ -172,26 +389,33 @@ class PaymentRegistrationModelMixin(RegistrationModelMixin):
         })
         serializer.is_valid(raise_exception=True)
         
-        paid_event = serializer.save()
-        headers = self.get_success_headers(serializer.data)
-        
-        # Создание QIWI платежа
-        bill = p2p.bill(
-            bill_id=paid_event.shortuuid,
-            amount=self.get_object().price,
-            lifetime=Setting.get("QIWI_PAYMENTS_LIFETIME"),
-            comment=f"Оплата регистрации №{paid_event.shortuuid}"
-        )
+        with transaction.atomic():
+            event = self.lock_event(pk)
+            if event.is_full(self.get_occupied_places(event)):
+                # Счет на оплату будет создан при освобождении места
+                serializer.save(waitlist_position=self.get_next_waitlist_position(event))
+                return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+            paid_event = serializer.save()
+            
+            if self.is_payment_async():
+                # Счет создается задачей после коммита, ссылка на оплату появится в регистрации после его создания
+                enqueue_task(create_registration_bill, registration_id=paid_event.pk)
+                return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
         
-        success_payment_url = getattr(settings, "SUCCESS_PAYMENT_URL", "")
+        headers = self.get_success_headers(serializer.data)
         
-        # Доабавление ссылки на оплату
-        paid_event.payment_link = bill.pay_url + f"&successUrl={success_payment_url}"
-        paid_event.save()
+        # Создание платежа
+        self.create_payment(provider, paid_event, event)
         serializer = self.event_registration_serializer_class(paid_event)
         
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
+    @registration.mapping.get
+    def get_registration(self, request, pk=None):
+        """ Регистрация текущего пользователя (для ожидания ссылки на оплату) """
+        registration = get_object_or_404(self.event_registration_model, event=pk, user=request.user.id)
+        return Response(self.event_registration_serializer_class(registration).data)
+    
     @registration.mapping.delete
     def delete_registration(self, request, pk=None):
         return super().delete_registration(request, pk)
\ No newline at end of file
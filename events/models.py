@@ -1,15 +1,23 @@
 import datetime
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from shortuuid.django_fields import ShortUUIDField
 from tinymce import models as tinymce_models
 
+from .indexes import NameSearchIndex
+
 events_images_folder_path = "events_images/"
 
 placeholder_image_path = events_images_folder_path + "placeholder.jpg"
 
+payment_check_base_delay = getattr(settings, "PAYMENT_CHECK_BASE_DELAY", 30)
+
+payment_check_max_delay = getattr(settings, "PAYMENT_CHECK_MAX_DELAY", 3600)
+
 
 class EventVenues(models.Model):
     name = models.CharField(
@@ -114,6 +122,11 @@ class AbstractEvents(models.Model):
         verbose_name="Максимум посетителей", default=0
     )
 
+    confirmed_visitors_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name="Кол-во подтвержденных посетителей"
+    )
+
     created = models.DateTimeField(
         auto_now_add=True, verbose_name="Дата добавления мероприятия"
     )
@@ -128,9 +141,26 @@ class AbstractEvents(models.Model):
     def visitors_len(self):
         return self.visitors.count()
 
+    def is_full(self, occupied_places=None):
+        """ Заняты ли все места на мероприятие (max_visitors = 0 - без ограничений) """
+        if occupied_places is None:
+            occupied_places = self.confirmed_visitors_count
+        return bool(self.max_visitors) and occupied_places >= self.max_visitors
+
     def end_datetime(self):
         return self.start_datetime + self.duration
 
+    @classmethod
+    def change_confirmed_visitors_count(cls, pk, delta):
+        """ Атомарно изменяет счетчик подтвержденных посетителей мероприятия 
+        (расхождение счетчика исправляет команда recount_confirmed_visitors) """
+        return cls.objects.filter(pk=pk).update(confirmed_visitors_count=F('confirmed_visitors_count') + delta)
+
+    @classmethod
+    def touch(cls, pks):
+        """ Обновляет дату изменения мероприятий, вложенные данные которых изменились """
+        return cls.objects.filter(pk__in=pks).update(updated=timezone.now())
+
     def __str__(self):
         return self.name
 
@@ -140,10 +170,24 @@ class AbstractEvents(models.Model):
             self.closing_registration_date = self.start_datetime
         if not self.image:
             self.image = placeholder_image_path
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Счетчик посетителей изменяется только через change_confirmed_visitors_count
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'confirmed_visitors_count'
+            ]
         super().save(*args, **kwargs)
 
     class Meta:
         abstract = True
+        # Индексы для фильтров списков мероприятий (EventsViewSet.filterset_fields), 
+        # SQL индекса по названию зависит от бд (см. NameSearchIndex)
+        indexes = [
+            NameSearchIndex(fields=('name', ), name='%(class)s_name_search_idx'),
+            models.Index(fields=('start_datetime', ), name='%(class)s_start_idx'),
+            models.Index(fields=('closing_registration_date', ), name='%(class)s_closing_date_idx'),
+            models.Index(fields=('duration', ), name='%(class)s_duration_idx'),
+        ]
 
 
 class Events(AbstractEvents):
@@ -171,7 +215,7 @@ class Events(AbstractEvents):
             eventregistrations__is_registration_confirmed=True
         ).count()
 
-    class Meta:
+    class Meta(AbstractEvents.Meta):
         ordering = ('-id', )
         verbose_name = 'мероприятие'
         verbose_name_plural = 'Мероприятия'
@@ -209,7 +253,7 @@ class PrivateEvents(AbstractEvents):
             privateeventregistrations__is_registration_confirmed=True
         ).count()
 
-    class Meta:
+    class Meta(AbstractEvents.Meta):
         ordering = ('-id', )
         verbose_name = 'приватное мероприятие'
         verbose_name_plural = 'Приватные мероприятия'
@@ -255,7 +299,7 @@ class PaidEvents(AbstractEvents):
             paideventregistrations__payment_status='PAID'
         ).count()
 
-    class Meta:
+    class Meta(AbstractEvents.Meta):
         ordering = ('-id', )
         verbose_name = 'платное мероприятие'
         verbose_name_plural = 'Платные мероприятия'
@@ -264,6 +308,11 @@ class PaidEvents(AbstractEvents):
 
 class AbstractEventRegistrations(models.Model):
 
+    # Условие, при котором регистрация учитывается в счетчике посетителей, и поля, от которых оно зависит
+    confirmed_visitor_filter = Q(is_registration_confirmed=True)
+
+    confirmed_visitor_fields = ('is_registration_confirmed', )
+
     shortuuid = ShortUUIDField(
         auto_created=True,
         alphabet="0123456789",
@@ -278,6 +327,11 @@ class AbstractEventRegistrations(models.Model):
         verbose_name="Принял ли пользователь приглашение на мероприятие"
     )
 
+    waitlist_position = models.PositiveIntegerField(
+        blank=True, null=True,
+        verbose_name="Позиция в листе ожидания"
+    )
+
     created = models.DateTimeField(
         auto_now_add=True, verbose_name="Дата регистрации на мероприятие"
     )
@@ -286,9 +340,73 @@ class AbstractEventRegistrations(models.Model):
         auto_now=True, verbose_name="Дата обновления регистрации на мероприятие"
     )
 
+    def is_confirmed_visitor(self):
+        return bool(self.is_registration_confirmed)
+
+    def affects_visitors_count(self, update_fields=None):
+        """ Может ли сохранение регистрации изменить счетчик посетителей """
+        fields = {'event_id', *self.confirmed_visitor_fields}
+        if update_fields is None:
+            # У объекта, загруженного через only / defer, сохраняются только загруженные поля
+            return bool(fields - self.get_deferred_fields())
+        return bool(fields & {self._meta.get_field(name).attname for name in update_fields})
+
+    def get_counted_event_id(self):
+        """ ID мероприятия, в счетчике которого учтена регистрация по данным бд 
+        (строка регистрации блокируется до конца транзакции) """
+        if self._state.adding:
+            return None
+        return type(self).objects.select_for_update().filter(
+            self.confirmed_visitor_filter, pk=self.pk
+        ).values_list('event_id', flat=True).first()
+
+    def sync_event_visitors_count(self, counted_event_id, deleted=False):
+        """ Приводит счетчик посетителей мероприятия в соответствие с регистрацией 
+        (counted_event_id - результат get_counted_event_id до изменения регистрации) """
+        event_id = self.event_id if not deleted and self.is_confirmed_visitor() else None
+        if event_id == counted_event_id:
+            return
+        event_model = self._meta.get_field('event').related_model
+        if counted_event_id is not None:
+            event_model.change_confirmed_visitors_count(counted_event_id, -1)
+        if event_id is not None:
+            event_model.change_confirmed_visitors_count(event_id, 1)
+
+    @classmethod
+    def get_occupied_places(cls, event):
+        """ Кол-во занятых мест на мероприятие """
+        return event.confirmed_visitors_count
+
+    def leave_waitlist(self):
+        """ Перевод регистрации из листа ожидания в подтвержденные """
+        self.waitlist_position = None
+        self.is_registration_confirmed = True
+        self.save(update_fields=('waitlist_position', 'is_registration_confirmed', 'updated'))
+
+    @classmethod
+    def promote_from_waitlist(cls, event_id):
+        """ Занимает освободившиеся места первыми пользователями из листа ожидания 
+        (мероприятие блокируется до конца транзакции) """
+        event_model = cls._meta.get_field('event').related_model
+        with transaction.atomic():
+            event = event_model.objects.select_for_update().filter(pk=event_id).first()
+            while event is not None and not event.is_full(cls.get_occupied_places(event)):
+                registration = cls.objects.filter(
+                    event=event, waitlist_position__isnull=False
+                ).order_by('waitlist_position').first()
+                if registration is None:
+                    break
+                registration.leave_waitlist()
+                event.refresh_from_db(fields=('confirmed_visitors_count', ))
+
     def save(self, *args, **kwargs):
         self.updated = timezone.now()
-        super().save(*args, **kwargs)
+        if not self.affects_visitors_count(kwargs.get('update_fields')):
+            return super().save(*args, **kwargs)
+        # Счетчик изменяется до сигналов post_save, которые сбрасывают кэш мероприятия
+        with transaction.atomic():
+            self.sync_event_visitors_count(self.get_counted_event_id())
+            super().save(*args, **kwargs)
 
     class Meta:
         abstract = True
@@ -327,6 +445,11 @@ class EventRegistrations(AbstractEventRegistrations):
         constraints = [
             models.UniqueConstraint(fields=unique_together, name='event_user_unique'),
         ]
+        indexes = [
+            models.Index(fields=('event', 'waitlist_position'), name='event_waitlist_idx'),
+            models.Index(fields=('event', 'is_registration_confirmed'), name='event_confirmed_idx'),
+            models.Index(fields=('user', '-id'), name='event_user_idx'),
+        ]
 
 
 class PrivateEventRegistrations(AbstractEventRegistrations):
@@ -362,6 +485,11 @@ class PrivateEventRegistrations(AbstractEventRegistrations):
         constraints = [
             models.UniqueConstraint(fields=unique_together, name='private_event_user_unique'),
         ]
+        indexes = [
+            models.Index(fields=('event', 'waitlist_position'), name='private_event_waitlist_idx'),
+            models.Index(fields=('event', 'is_registration_confirmed'), name='private_event_confirmed_idx'),
+            models.Index(fields=('user', '-id'), name='private_event_user_idx'),
+        ]
 
 
 class PaidEventRegistrations(AbstractEventRegistrations):
@@ -373,6 +501,13 @@ class PaidEventRegistrations(AbstractEventRegistrations):
         EXPIRED = "EXPIRED", "Время жизни счета истекло. Счет не оплачен."
         REJECTED = "REJECTED", "Платёж отклонен"
 
+    confirmed_visitor_filter = Q(is_registration_confirmed=True, payment_status=PaymentStatuses.PAID)
+
+    # Счет закрыт без оплаты: место, которое занимала регистрация, освобождается (см. get_occupied_places)
+    released_payment_statuses = (PaymentStatuses.EXPIRED, PaymentStatuses.REJECTED)
+
+    confirmed_visitor_fields = ('is_registration_confirmed', 'payment_status')
+
     event = models.ForeignKey(
         PaidEvents, on_delete=models.CASCADE,
         verbose_name="ID платного мероприятия"
@@ -401,6 +536,59 @@ class PaidEventRegistrations(AbstractEventRegistrations):
         blank=True, null=True,
     )
 
+    payment_expires_at = models.DateTimeField(
+        verbose_name="Дата истечения счета на оплату",
+        blank=True, null=True,
+    )
+
+    next_check_at = models.DateTimeField(
+        verbose_name="Дата следующей проверки статуса оплаты",
+        blank=True, null=True,
+    )
+
+    payment_check_attempts = models.PositiveIntegerField(
+        default=0, verbose_name="Кол-во проверок статуса оплаты"
+    )
+
+    def is_confirmed_visitor(self):
+        return bool(self.is_registration_confirmed) and self.payment_status == self.PaymentStatuses.PAID
+
+    def is_payment_expired(self, now=None):
+        """ Истекло ли время жизни счета на оплату """
+        return self.payment_expires_at is not None and self.payment_expires_at <= (now or timezone.now())
+
+    def start_payment_checks(self, lifetime, now=None):
+        """ Планирует проверки статуса оплаты нового счета (lifetime - время жизни счета в минутах) """
+        now = now or timezone.now()
+        self.payment_expires_at = now + datetime.timedelta(minutes=int(lifetime))
+        self.payment_check_attempts = 0
+        self.next_check_at = now + datetime.timedelta(seconds=payment_check_base_delay)
+
+    def schedule_next_payment_check(self, now=None):
+        """ Планирует следующую проверку статуса оплаты с экспоненциально растущей задержкой
+        (не позже истечения счета) """
+        now = now or timezone.now()
+        delay = min(payment_check_base_delay * 2 ** self.payment_check_attempts, payment_check_max_delay)
+        self.payment_check_attempts += 1
+        self.next_check_at = now + datetime.timedelta(seconds=delay)
+        if self.payment_expires_at is not None:
+            self.next_check_at = min(self.next_check_at, self.payment_expires_at)
+
+    @classmethod
+    def get_occupied_places(cls, event):
+        # Места с неоплаченными счетами тоже заняты, пока счет не истек или не отклонен
+        return event.confirmed_visitors_count + cls.objects.filter(
+            event=event,
+            payment_status__in=(cls.PaymentStatuses.CREATED, cls.PaymentStatuses.WAITING),
+            waitlist_position__isnull=True
+        ).count()
+
+    def leave_waitlist(self):
+        # Место закрепляется за пользователем на время жизни счета на оплату, 
+        # счет создается задачей create_registration_bill (см. events.signals)
+        self.waitlist_position = None
+        self.save(update_fields=('waitlist_position', 'updated'))
+
     def save(self, *args, **kwargs):
         if not self.inviting_user:
             self.inviting_user = self.user
@@ -415,4 +603,83 @@ class PaidEventRegistrations(AbstractEventRegistrations):
         unique_together = ('event', 'user')
         constraints = [
             models.UniqueConstraint(fields=unique_together, name='paid_event_user_unique'),
-        ]
\ No newline at end of file
+        ]
+        indexes = [
+            models.Index(fields=('event', 'waitlist_position'), name='paid_event_waitlist_idx'),
+            models.Index(
+                fields=('event', 'is_registration_confirmed', 'payment_status'), name='paid_event_confirmed_idx'
+            ),
+            models.Index(fields=('user', '-id'), name='paid_event_user_idx'),
+            # Частичный индекс только по неоплаченным счетам, которые проверяет payment_handler
+            models.Index(
+                fields=('next_check_at', 'id'), name='paid_pending_payment_idx',
+                condition=Q(payment_status__in=('CREATED', 'WAITING')),
+            ),
+        ]
+
+class SentReminders(models.Model):
+    """ Ledger of sent event reminders: a reminder is sent once per registration and days before the event """
+
+    class RegistrationTypes(models.TextChoices):
+        EVENT = "EVENT", "Регистрация на мероприятие"
+        PRIVATE = "PRIVATE", "Регистрация на приватное мероприятие"
+        PAID = "PAID", "Регистрация на платное мероприятие"
+
+    registration_type = models.CharField(
+        max_length=10, choices=RegistrationTypes.choices,
+        verbose_name="Тип регистрации"
+    )
+
+    registration_id = models.PositiveBigIntegerField(
+        verbose_name="ID регистрации"
+    )
+
+    days_before = models.PositiveSmallIntegerField(
+        verbose_name="За сколько дней до мероприятия отправлено напоминание"
+    )
+
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name="Дата отправки напоминания"
+    )
+
+    def __str__(self):
+        return f"Напоминание за {self.days_before} дн. для регистрации ID {self.registration_id} ({self.registration_type})"
+
+    class Meta:
+        verbose_name = 'отправленное напоминание'
+        verbose_name_plural = 'Отправленные напоминания'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('registration_type', 'registration_id', 'days_before'), name='sent_reminder_unique'
+            ),
+        ]
+
+
+class OutboxMessages(models.Model):
+    """ Transactional outbox: Celery tasks are saved in the same transaction as the changes
+    that caused them and are sent to the broker only after commit (see events.outbox) """
+
+    task_name = models.CharField(
+        max_length=255, verbose_name="Название задачи"
+    )
+
+    kwargs = models.JSONField(
+        default=dict, blank=True, verbose_name="Аргументы задачи"
+    )
+
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name="Дата создания сообщения"
+    )
+
+    relay_error = models.TextField(
+        blank=True, null=True,
+        verbose_name="Ошибка передачи задачи (сообщение не передается, пока ошибка не очищена)"
+    )
+
+    def __str__(self):
+        return f"Сообщение №{self.pk} - {self.task_name}"
+
+    class Meta:
+        ordering = ('id', )
+        verbose_name = 'сообщение outbox'
+        verbose_name_plural = 'Сообщения outbox'
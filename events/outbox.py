@@ -0,0 +1,59 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from . import tasks
+from .models import OutboxMessages
+
+logger = logging.getLogger(__name__)
+
+outbox_relay_on_commit = getattr(settings, 'OUTBOX_RELAY_ON_COMMIT', False)
+
+
+# Transactional outbox
+
+# Задачи сохраняются в OutboxMessages в той же транзакции, что и изменения, из-за которых они появились,
+# поэтому задачи отмененных транзакций не отправляются. В брокер сообщения передает периодическая задача
+# relay_outbox_messages, при OUTBOX_RELAY_ON_COMMIT - еще и сразу после коммита, одной задачей на пачку
+
+
+class PendingMessages:
+    """ Outbox messages of the current transaction, relayed to the broker by an on_commit callback """
+
+    def __init__(self, message_ids):
+        self.message_ids = list(message_ids)
+        self.flushed = False
+
+    @classmethod
+    def add(cls, message_id, using=None):
+        """ Добавление сообщения в список текущей транзакции
+
+        Список хранится в очереди on_commit соединения, поэтому при откате транзакции (или точки сохранения,
+        в которой он создан) удаляется вместе с ней, и следующая транзакция начинает новый список 
+        (id из откаченных вложенных точек сохранения остаются в списке, но таких сообщений нет в бд) """
+        connection = transaction.get_connection(using)
+        for _, callback, *_ in connection.run_on_commit:
+            if isinstance(callback, cls) and not callback.flushed:
+                callback.message_ids.append(message_id)
+                return
+        # Вне транзакции callback вызывается сразу
+        transaction.on_commit(cls([message_id]), using=using)
+
+    def __call__(self):
+        """ Передача сообщений пачками по OUTBOX_BATCH_SIZE """
+        self.flushed = True
+        for start in range(0, len(self.message_ids), tasks.outbox_batch_size):
+            try:
+                tasks.relay_outbox_messages.delay(self.message_ids[start:start + tasks.outbox_batch_size])
+            except Exception:
+                # Сообщения останутся в outbox до запуска периодической задачи
+                logger.exception("Outbox messages relay failed")
+
+
+def enqueue_task(task, **kwargs):
+    """ Отправка задачи в брокер после коммита текущей транзакции """
+    message = OutboxMessages.objects.create(task_name=task.name, kwargs=kwargs)
+    if outbox_relay_on_commit:
+        PendingMessages.add(message.pk)
+    return message
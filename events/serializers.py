@@ -14,7 +14,7 @@ class EventRegistrationsSerializer(serializers.ModelSerializer):
     class Meta:
         model = EventRegistrations
         fields = '__all__'
-        read_only_fields = ('shortuuid', )
+        read_only_fields = ('shortuuid', 'waitlist_position')
 
 
     def validate(self, attrs):
@@ -28,15 +28,15 @@ class PrivateEventRegistrationsSerializer(EventRegistrationsSerializer):
     class Meta:
         model = PrivateEventRegistrations
         fields = '__all__'
-        read_only_fields = ('shortuuid', )
+        read_only_fields = ('shortuuid', 'waitlist_position')
 
 
 
 class PaidEventRegistrationsSerializer(EventRegistrationsSerializer):
     class Meta:
         model = PaidEventRegistrations
-        fields = '__all__'
-        read_only_fields = ('shortuuid', 'payment_status', 'payment_link')
+        exclude = ('next_check_at', 'payment_check_attempts')
+        read_only_fields = ('shortuuid', 'waitlist_position', 'payment_status', 'payment_link', 'payment_expires_at')
 
 
 class EventInvitationsSerializer(EventRegistrationsSerializer):
@@ -70,10 +70,13 @@ class EventsSerializer(serializers.ModelSerializer):
         depth = 1
 
     def get_visitors(self, obj):
-        queryset = EventRegistrations.objects.filter(
-            is_registration_confirmed=True,
-            event=obj.id
-        ).order_by('-id')
+        # Список берется из Prefetch-кэша ViewSet'а, если он есть
+        queryset = getattr(obj, 'confirmed_registrations', None)
+        if queryset is None:
+            queryset = EventRegistrations.objects.filter(
+                is_registration_confirmed=True,
+                event=obj.id
+            ).order_by('-id')
         serializer = EventRegistrationsSerializer(queryset, many=True)
         return serializer.data
 
@@ -86,10 +89,12 @@ class PrivateEventsSerializer(serializers.ModelSerializer):
         exclude = ('invitation_code', )
         
     def get_visitors(self, obj):
-        queryset = PrivateEventRegistrations.objects.filter(
-            is_registration_confirmed=True,
-            event=obj.id
-        ).order_by('-id')
+        queryset = getattr(obj, 'confirmed_registrations', None)
+        if queryset is None:
+            queryset = PrivateEventRegistrations.objects.filter(
+                is_registration_confirmed=True,
+                event=obj.id
+            ).order_by('-id')
         serializer = PrivateEventRegistrationsSerializer(queryset, many=True)
         return serializer.data
 
@@ -102,11 +107,13 @@ class PaidEventsSerializer(serializers.ModelSerializer):
         exclude = ('invitation_code', )
         
     def get_visitors(self, obj):
-        queryset = PaidEventRegistrations.objects.filter(
-            is_registration_confirmed=True,
-            event=obj.id,
-            payment_status=PaidEventRegistrations.PaymentStatuses.PAID
-        ).order_by('-id')
+        queryset = getattr(obj, 'confirmed_registrations', None)
+        if queryset is None:
+            queryset = PaidEventRegistrations.objects.filter(
+                is_registration_confirmed=True,
+                event=obj.id,
+                payment_status=PaidEventRegistrations.PaymentStatuses.PAID
+            ).order_by('-id')
         serializer = PaidEventRegistrationsSerializer(queryset, many=True)
         return serializer.data
 
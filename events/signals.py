@@ -1,9 +1,20 @@
-from django.db.models import signals
+from itertools import islice
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import QuerySet, signals
 from django.dispatch import receiver
+from extra_settings.models import Setting
+
+from config.qiwi import clear_QIWI_clients
 
-from .models import (EventRegistrations, Events, PaidEventRegistrations,
-                     PaidEvents, PrivateEventRegistrations, PrivateEvents)
-from .tasks import (notify_event_cancellation, notify_paid_event_cancellation,
+from .cache import invalidate_lists, invalidate_objects
+from .models import (EventRegistrations, Events, EventTypes, EventVenues,
+                     PaidEventRegistrations, PaidEvents,
+                     PrivateEventRegistrations, PrivateEvents)
+from .outbox import enqueue_task
+from .tasks import (create_registration_bill, notify_event_cancellation,
+                    notify_paid_event_cancellation,
                     notify_private_event_cancellation,
                     send_paid_registration_delete_notification,
                     send_paid_registration_notification,
@@ -12,15 +23,155 @@ from .tasks import (notify_event_cancellation, notify_paid_event_cancellation,
                     send_registration_delete_notification,
                     send_registration_notification)
 
+cancellation_notification_chunk_size = getattr(settings, "CANCELLATION_NOTIFICATION_CHUNK_SIZE", 500)
+
+
+def is_deleted_with_event(sender, origin):
+    """ Регистрация удаляется каскадно вместе с мероприятием (origin - объект или QuerySet, с которого началось удаление) 
+    
+    Об отмене мероприятия участники уведомляются пачками (см. Events_pre_delete), а счетчик посетителей 
+    и кэш удаляемого мероприятия обновлять не нужно, поэтому обработка каждой регистрации пропускается """
+    event_model = sender._meta.get_field('event').related_model
+    return isinstance(origin, event_model) or (isinstance(origin, QuerySet) and origin.model is event_model)
+
+
+# Denormalized confirmed visitors counter
+
+# При сохранении счетчик изменяется в AbstractEventRegistrations.save, при удалении - в pre_delete, 
+# который вызывается в транзакции удаления: строка регистрации остается заблокированной до ее удаления
+
+@receiver(signals.pre_delete, sender=EventRegistrations)
+@receiver(signals.pre_delete, sender=PrivateEventRegistrations)
+@receiver(signals.pre_delete, sender=PaidEventRegistrations)
+def EventRegistrations_delete_visitors_count(sender, instance, origin=None, **kwargs):
+    if is_deleted_with_event(sender, origin):
+        return
+    instance.sync_event_visitors_count(instance.get_counted_event_id(), deleted=True)
+
+
+# Waitlist
+
+# Освободившиеся места занимают пользователи из листа ожидания: при удалении регистрации 
+# (в том числе из админки или вместе с пользователем), при изменении мероприятия (увеличение max_visitors) 
+# и когда счет на оплату истекает или отклоняется (bulk_update в payment_handler - см. apply_payment_statuses)
+
+event_registration_models = {
+    Events: EventRegistrations,
+    PrivateEvents: PrivateEventRegistrations,
+    PaidEvents: PaidEventRegistrations,
+}
+
+
+def is_promoted_from_waitlist(instance, update_fields):
+    """ Регистрация сохранена при переводе из листа ожидания (см. AbstractEventRegistrations.leave_waitlist) """
+    return bool(update_fields) and 'waitlist_position' in update_fields and instance.waitlist_position is None
+
+
+def is_place_released(instance, update_fields):
+    """ Счет регистрации закрыт без оплаты, и место, которое она занимала, освободилось """
+    return (
+        instance.payment_status in instance.released_payment_statuses and instance.waitlist_position is None
+        and (update_fields is None or 'payment_status' in update_fields)
+    )
+
+
+@receiver(signals.post_delete, sender=EventRegistrations)
+@receiver(signals.post_delete, sender=PrivateEventRegistrations)
+@receiver(signals.post_delete, sender=PaidEventRegistrations)
+def EventRegistrations_promote_from_waitlist(sender, instance, origin=None, **kwargs):
+    if is_deleted_with_event(sender, origin):
+        return
+    sender.promote_from_waitlist(instance.event_id)
+
+
+@receiver(signals.post_save, sender=Events)
+@receiver(signals.post_save, sender=PrivateEvents)
+@receiver(signals.post_save, sender=PaidEvents)
+def Events_promote_from_waitlist(sender, instance, created, **kwargs):
+    if not created:
+        event_registration_models[sender].promote_from_waitlist(instance.pk)
+
+
+@receiver(signals.post_save, sender=PaidEventRegistrations)
+def PaidEventRegistrations_promote_from_waitlist(sender, instance, created, update_fields=None, **kwargs):
+    if not created and is_place_released(instance, update_fields):
+        sender.promote_from_waitlist(instance.event_id)
+
+
+# Cache invalidation
+
+@receiver(signals.post_save, sender=Events)
+@receiver(signals.post_save, sender=PrivateEvents)
+@receiver(signals.post_save, sender=PaidEvents)
+@receiver(signals.post_save, sender=EventVenues)
+@receiver(signals.post_save, sender=EventTypes)
+@receiver(signals.post_delete, sender=Events)
+@receiver(signals.post_delete, sender=PrivateEvents)
+@receiver(signals.post_delete, sender=PaidEvents)
+@receiver(signals.post_delete, sender=EventVenues)
+@receiver(signals.post_delete, sender=EventTypes)
+def invalidate_object_cache(sender, instance, **kwargs):
+    invalidate_objects(sender, [instance.pk])
+    invalidate_lists(sender)
+
+
+# Места проведения, типы и регистрации вложены в сериализованные мероприятия, поэтому 
+# при их изменении обновляется и дата изменения мероприятий (ETag / Last-Modified) 
+# (pre_delete - до того, как у мероприятий обнулится ссылка на тип)
+
+@receiver(signals.post_save, sender=EventVenues)
+@receiver(signals.post_save, sender=EventTypes)
+@receiver(signals.pre_delete, sender=EventVenues)
+@receiver(signals.pre_delete, sender=EventTypes)
+def invalidate_related_events_cache(sender, instance, **kwargs):
+    field_name = 'venue' if sender is EventVenues else 'category'
+    for event_model in (Events, PrivateEvents, PaidEvents):
+        pks = list(event_model.objects.filter(**{field_name: instance.pk}).values_list('pk', flat=True))
+        event_model.touch(pks)
+        invalidate_objects(event_model, pks)
+
+
+@receiver(signals.post_save, sender=EventRegistrations)
+@receiver(signals.post_save, sender=PrivateEventRegistrations)
+@receiver(signals.post_save, sender=PaidEventRegistrations)
+@receiver(signals.post_delete, sender=EventRegistrations)
+@receiver(signals.post_delete, sender=PrivateEventRegistrations)
+@receiver(signals.post_delete, sender=PaidEventRegistrations)
+def invalidate_event_cache(sender, instance, origin=None, **kwargs):
+    if is_deleted_with_event(sender, origin):
+        return
+    event_model = sender._meta.get_field('event').related_model
+    event_model.touch([instance.event_id])
+    invalidate_objects(event_model, [instance.event_id])
+    invalidate_lists(event_model)
+
+
+# QIWI clients invalidation
+
+@receiver(signals.post_save, sender=Setting)
+@receiver(signals.post_delete, sender=Setting)
+def Setting_clear_QIWI_clients(sender, instance, **kwargs):
+    if instance.name == "QIWI_PRIVATE_KEY":
+        clear_QIWI_clients()
+
+
+@receiver(setting_changed)
+def settings_clear_QIWI_clients(setting, **kwargs):
+    if setting in ("QIWI_PRIVATE_KEY", "EXTRA_SETTINGS_DEFAULTS"):
+        clear_QIWI_clients()
+
+
 # Tasks based on model signals 
 
 
 # Sending email notification when user registered for the event
 
 @receiver(signals.post_save, sender=EventRegistrations)
-def EventRegistrations_post_save(sender, instance, created, **kwargs):
-    if created and instance.is_registration_confirmed: # object is being created
-        send_registration_notification.delay(
+def EventRegistrations_post_save(sender, instance, created, update_fields=None, **kwargs):
+    # object is being created or promoted from the waitlist
+    if (created or is_promoted_from_waitlist(instance, update_fields)) and instance.is_registration_confirmed:
+        enqueue_task(
+            send_registration_notification,
             event_name=instance.event.name,
             registration_shortuuid=instance.shortuuid,
             user_email=instance.user.email
@@ -29,16 +180,20 @@ def EventRegistrations_post_save(sender, instance, created, **kwargs):
 @receiver(signals.post_save, sender=PrivateEventRegistrations)
 def PrivateEventRegistrations_post_save(sender, instance, created, **kwargs):
     if instance.is_registration_confirmed:
-        send_private_registration_notification.delay(
+        enqueue_task(
+            send_private_registration_notification,
             event_name=instance.event.name,
             registration_shortuuid=instance.shortuuid,
             user_email=instance.user.email
         )
         
 @receiver(signals.post_save, sender=PaidEventRegistrations)
-def PaidEventRegistrations_post_save(sender, instance, created, **kwargs):
+def PaidEventRegistrations_post_save(sender, instance, created, update_fields=None, **kwargs):
+    if is_promoted_from_waitlist(instance, update_fields):
+        enqueue_task(create_registration_bill, registration_id=instance.pk)
     if instance.is_registration_confirmed and instance.payment_status == instance.PaymentStatuses.PAID:
-        send_paid_registration_notification.delay(
+        enqueue_task(
+            send_paid_registration_notification,
             event_name=instance.event.name,
             registration_shortuuid=instance.shortuuid,
             user_email=instance.user.email
@@ -48,24 +203,33 @@ def PaidEventRegistrations_post_save(sender, instance, created, **kwargs):
 # Sending email notification when user delete registration for the event
 
 @receiver(signals.post_delete, sender=EventRegistrations)
-def EventRegistrations_post_delete(sender, instance, **kwargs):
-    send_registration_delete_notification.delay(
+def EventRegistrations_post_delete(sender, instance, origin=None, **kwargs):
+    if is_deleted_with_event(sender, origin):
+        return
+    enqueue_task(
+        send_registration_delete_notification,
         event_name=instance.event.name,
         registration_shortuuid=instance.shortuuid,
         user_email=instance.user.email
     )
         
 @receiver(signals.post_delete, sender=PrivateEventRegistrations)
-def PrivateEventRegistrations_post_delete(sender, instance, **kwargs):
-    send_private_registration_delete_notification.delay(
+def PrivateEventRegistrations_post_delete(sender, instance, origin=None, **kwargs):
+    if is_deleted_with_event(sender, origin):
+        return
+    enqueue_task(
+        send_private_registration_delete_notification,
         event_name=instance.event.name,
         registration_shortuuid=instance.shortuuid,
         user_email=instance.user.email
     )
         
 @receiver(signals.post_delete, sender=PaidEventRegistrations)
-def PaidEventRegistrations_post_delete(sender, instance, **kwargs):
-    send_paid_registration_delete_notification.delay(
+def PaidEventRegistrations_post_delete(sender, instance, origin=None, **kwargs):
+    if is_deleted_with_event(sender, origin):
+        return
+    enqueue_task(
+        send_paid_registration_delete_notification,
         event_name=instance.event.name,
         registration_shortuuid=instance.shortuuid,
         user_email=instance.user.email
@@ -74,23 +238,24 @@ def PaidEventRegistrations_post_delete(sender, instance, **kwargs):
         
 # Sending email notification of deleting the event
 
-@receiver(signals.post_delete, sender=Events)
-def Events_post_save(sender, instance, **kwargs):
-    notify_event_cancellation.delay(
-        event_name=instance.name,
-        recipients=[registration.user.email for registration in EventRegistrations.objects.filter(event=instance.id, is_registration_confirmed=True)]
-    )
-        
-@receiver(signals.post_delete, sender=PrivateEvents)
-def PrivateEvents_post_save(sender, instance, **kwargs):
-    notify_private_event_cancellation.delay(
-        event_name=instance.name,
-        recipients=[registration.user.email for registration in PrivateEventRegistrations.objects.filter(event=instance.id, is_registration_confirmed=True)]
-    )
-        
-@receiver(signals.post_delete, sender=PaidEvents)
-def PaidEvents_post_save(sender, instance, **kwargs):
-    notify_paid_event_cancellation.delay(
-        event_name=instance.name,
-        recipients=[registration.user.email for registration in PaidEventRegistrations.objects.filter(event=instance.id, is_registration_confirmed=True, payment_status="PAID")]
-    )
\ No newline at end of file
+# Получатели собираются в pre_delete, пока регистрации не удалены каскадно. Сигналы отправляются
+# для каждого мероприятия и при удалении через QuerySet.delete() (например, из админки)
+
+event_cancellation_notifications = {
+    Events: (EventRegistrations, notify_event_cancellation),
+    PrivateEvents: (PrivateEventRegistrations, notify_private_event_cancellation),
+    PaidEvents: (PaidEventRegistrations, notify_paid_event_cancellation),
+}
+
+@receiver(signals.pre_delete, sender=Events)
+@receiver(signals.pre_delete, sender=PrivateEvents)
+@receiver(signals.pre_delete, sender=PaidEvents)
+def Events_pre_delete(sender, instance, **kwargs):
+    registration_model, notify_cancellation = event_cancellation_notifications[sender]
+    recipients = registration_model.objects.filter(
+        registration_model.confirmed_visitor_filter, event=instance.pk
+    ).order_by('id').values_list('user__email', flat=True).iterator(chunk_size=cancellation_notification_chunk_size)
+    
+    # Получатели разбиваются на пачки, чтобы аргументы одной задачи не росли с кол-вом регистраций
+    while chunk := list(islice(recipients, cancellation_notification_chunk_size)):
+        enqueue_task(notify_cancellation, event_name=instance.name, recipients=chunk)
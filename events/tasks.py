@@ -1,62 +1,402 @@
-from datetime import timedelta
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
 
-from celery import shared_task
+from celery import current_app, group, shared_task
 from django.conf import settings
-from django.core.mail import send_mail
-from django.db.models import Q
+from django.core.mail import EmailMessage, get_connection, send_mail
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
 from django.utils import timezone
+from extra_settings.models import Setting
 
-from config.qiwi import get_QIWI_p2p
+from config.payments import get_payment_provider
 
-from .models import EventRegistrations, PaidEventRegistrations
+from . import outbox
+from .cache import invalidate_lists, invalidate_objects
+from .models import (EventRegistrations, OutboxMessages,
+                     PaidEventRegistrations, PaidEvents,
+                     PrivateEventRegistrations, SentReminders)
+
+logger = logging.getLogger(__name__)
 
 payment_statuses = PaidEventRegistrations.PaymentStatuses
 
 notification_days_before_events = getattr(settings, "NOTIFICATION_DAYS_BEFORE_EVENTS", None)
 
+payment_handler_chunk_size = getattr(settings, "PAYMENT_HANDLER_CHUNK_SIZE", 500)
+
+payment_handler_max_workers = getattr(settings, "PAYMENT_HANDLER_MAX_WORKERS", 8)
+
+payment_bill_retry_delay = getattr(settings, "PAYMENT_BILL_RETRY_DELAY", 10)
+
+email_chunk_size = getattr(settings, "EMAIL_CHUNK_SIZE", 100)
+
+email_rate_limit = getattr(settings, "EMAIL_RATE_LIMIT", None)
+
+reminder_chunk_size = getattr(settings, "REMINDER_CHUNK_SIZE", 500)
+
+outbox_batch_size = getattr(settings, "OUTBOX_BATCH_SIZE", 100)
+
+registration_types = SentReminders.RegistrationTypes
+
+# Модели регистраций и название мероприятия в напоминании для каждого типа регистрации
+reminder_registrations = {
+    registration_types.EVENT: (EventRegistrations, "мероприятие"),
+    registration_types.PRIVATE: (PrivateEventRegistrations, "приватное мероприятие"),
+    registration_types.PAID: (PaidEventRegistrations, "платное мероприятие"),
+}
+
+
+# Mass email sending
+
+def send_mass_email(datatuples, on_sent=None):
+    """ Отправка писем пачками по EMAIL_CHUNK_SIZE через одно SMTP соединение 
+    
+    datatuples - (subject, message, from_email, recipient_list) для каждого письма, 
+    on_sent(index) вызывается сразу после отправки письма с номером index в datatuples 
+    (при ошибке отправки так можно узнать, какие письма уже отправлены), 
+    возвращает номера отправленных писем """
+    datatuples = enumerate(datatuples)
+    sent = []
+    started = time.monotonic()
+    with get_connection() as connection:
+        while chunk := list(islice(datatuples, email_chunk_size)):
+            for index, (subject, message, from_email, recipient_list) in chunk:
+                if EmailMessage(subject, message, from_email, recipient_list, connection=connection).send():
+                    sent.append(index)
+                    if on_sent is not None:
+                        on_sent(index)
+            if email_rate_limit:
+                # Пауза, если письма отправляются быстрее EMAIL_RATE_LIMIT писем в секунду
+                delay = len(sent) / email_rate_limit - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+    return sent
+
+
+def send_to_recipients(task, subject, message, recipients, **task_kwargs):
+    """ Отправка отдельного письма каждому получателю, чтобы адреса участников не были видны друг другу 
+    
+    При ошибке задача task повторяется только для получателей, которым письмо еще не отправлено 
+    (task_kwargs - остальные аргументы задачи), возвращает кол-во отправленных писем """
+    sent = set()
+    try:
+        send_mass_email(
+            ((subject, message, settings.EMAIL_HOST_USER, [recipient]) for recipient in recipients), on_sent=sent.add
+        )
+    except Exception as error:
+        remaining_recipients = [recipient for index, recipient in enumerate(recipients) if index not in sent]
+        raise task.retry(args=(), kwargs={**task_kwargs, 'recipients': remaining_recipients}, exc=error)
+    return len(sent)
+
 
 # Tasks
 
+def create_bill(provider, registration, event=None):
+    """ Создание счета на оплату регистрации """
+    event = event or registration.event
+    lifetime = Setting.get("QIWI_PAYMENTS_LIFETIME")
+    bill = provider.create_bill(
+        bill_id=registration.shortuuid,
+        amount=event.price,
+        lifetime=lifetime,
+        comment=f"Оплата регистрации №{registration.shortuuid}"
+    )
+    registration.start_payment_checks(lifetime)
+    
+    success_payment_url = getattr(settings, "SUCCESS_PAYMENT_URL", "")
+    
+    # Доабавление ссылки на оплату
+    registration.payment_link = bill.pay_url + f"&successUrl={success_payment_url}"
+    registration.save()
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=payment_bill_retry_delay)
+def create_registration_bill(self, registration_id):
+    """Создание счета на оплату регистрации вне запроса пользователя"""
+    # Счет создается один раз, повторный запуск задачи ничего не меняет
+    registration = PaidEventRegistrations.objects.select_related('event').filter(
+        pk=registration_id,
+        payment_status=payment_statuses.CREATED,
+        payment_link__isnull=True,
+        waitlist_position__isnull=True
+    ).first()
+    if registration is None:
+        return f"No bill to create for registration with id: {registration_id}"
+    
+    provider = get_payment_provider()
+    try:
+        if provider is None:
+            raise ValueError("Set QIWI_PRIVATE_KEY setting!")
+        create_bill(provider, registration)
+    except Exception as error:
+        raise self.retry(exc=error)
+    return f"Bill for registration with id: {registration.shortuuid} have been created"
+
+
+def apply_payment_statuses(changes):
+    """ Сохранение новых статусов оплаты пачкой 
+    
+    changes - пары (регистрация с новым статусом, статус оплаты, с которым она была загружена). 
+    Регистрации перечитываются под блокировкой и пропускаются, если статус за время проверки уже 
+    изменило уведомление QIWI (QiwiNotificationView). bulk_update не вызывает сигналы, поэтому 
+    счетчики посетителей, лист ожидания, кэш мероприятий и уведомления об оплате обновляются здесь 
+    только для сохраненных регистраций (см. events.signals), возвращает сохраненные регистрации """
+    now = timezone.now()
+    applied, newly_confirmed = [], []
+    visitors_count_deltas = Counter()
+    with transaction.atomic():
+        current_states = {
+            pk: (payment_status, is_registration_confirmed)
+            for pk, payment_status, is_registration_confirmed in PaidEventRegistrations.objects.select_for_update().filter(
+                pk__in=[registration.pk for registration, _ in changes]
+            ).values_list('pk', 'payment_status', 'is_registration_confirmed')
+        }
+        for registration, loaded_payment_status in changes:
+            if registration.pk not in current_states:
+                continue
+            payment_status, is_registration_confirmed = current_states[registration.pk]
+            if payment_status != loaded_payment_status:
+                continue
+            
+            was_confirmed_visitor = bool(is_registration_confirmed) and payment_status == payment_statuses.PAID
+            registration.is_registration_confirmed = (
+                bool(is_registration_confirmed) or registration.payment_status == payment_statuses.PAID
+            )
+            registration.updated = now
+            applied.append(registration)
+            if registration.is_confirmed_visitor() != was_confirmed_visitor:
+                visitors_count_deltas[registration.event_id] += 1 if registration.is_confirmed_visitor() else -1
+                if registration.is_confirmed_visitor():
+                    newly_confirmed.append(registration)
+        
+        if not applied:
+            return applied
+        
+        event_ids = {registration.event_id for registration in applied}
+        PaidEventRegistrations.objects.bulk_update(
+            applied, [
+                'payment_status', 'is_registration_confirmed', 'next_check_at', 'payment_check_attempts', 'updated'
+            ]
+        )
+        for event_id, delta in visitors_count_deltas.items():
+            if delta:
+                PaidEvents.change_confirmed_visitors_count(event_id, delta)
+        # Места истекших и отклоненных счетов занимают пользователи из листа ожидания
+        for event_id in {
+            registration.event_id for registration in applied
+            if registration.payment_status in PaidEventRegistrations.released_payment_statuses
+        }:
+            PaidEventRegistrations.promote_from_waitlist(event_id)
+        PaidEvents.touch(event_ids)
+        invalidate_objects(PaidEvents, event_ids)
+        invalidate_lists(PaidEvents)
+        
+        for registration in newly_confirmed:
+            outbox.enqueue_task(
+                send_paid_registration_notification,
+                event_name=registration.event.name,
+                registration_shortuuid=registration.shortuuid,
+                user_email=registration.user.email
+            )
+    return applied
+
+
 @shared_task
 def payment_handler():
-    """Обработчик платежей QIWI"""
+    """Обработчик платежей"""
+    provider = get_payment_provider()
+    if provider is None:
+        return "No payments to handle for now..."
+    
+    now = timezone.now()
+    
+    # Повторное создание счетов, которые не удалось создать
+    for registration_id in PaidEventRegistrations.objects.filter(
+        payment_status=payment_statuses.CREATED,
+        payment_link__isnull=True,
+        waitlist_position__isnull=True,
+        updated__lte=now - timedelta(seconds=payment_bill_retry_delay * 10)
+    ).values_list('pk', flat=True):
+        create_registration_bill.delay(registration_id)
+    
+    # Проверяются только созданные счета, время проверки которых подошло
+    # (условие по статусу совпадает с условием частичного индекса paid_pending_payment_idx)
+    registrations = PaidEventRegistrations.objects.filter(
+        Q(next_check_at__isnull=True) | Q(next_check_at__lte=now),
+        payment_status__in=(payment_statuses.CREATED, payment_statuses.WAITING),
+        waitlist_position__isnull=True,
+        payment_link__isnull=False
+    ).select_related('event', 'user').only(
+        'shortuuid', 'payment_status', 'is_registration_confirmed', 
+        'payment_expires_at', 'next_check_at', 'payment_check_attempts',
+        'event', 'event__name', 'user', 'user__email'
+    ).order_by(F('next_check_at').asc(nulls_first=True), 'id')
+    
     result = ""
-    p2p = get_QIWI_p2p()
-    if p2p != None and PaidEventRegistrations.objects.filter(Q(payment_status=payment_statuses.CREATED) | Q(payment_status=payment_statuses.WAITING)).exists():
-        for registration in PaidEventRegistrations.objects.filter(Q(payment_status=payment_statuses.CREATED) | Q(payment_status=payment_statuses.WAITING)):
-            payment_status = p2p.check(registration.shortuuid).status
-            if registration.payment_status != payment_status:
-                result += f'\nRegistration payment with id: {registration.shortuuid} have new payment status {registration.payment_status} -> {payment_status}. '
-                registration.payment_status = payment_status
-                if payment_status == "PAID":
-                    registration.is_registration_confirmed = True
-                registration.save()
-            if payment_status in (payment_statuses.REJECTED, payment_statuses.EXPIRED):
-                p2p.reject(registration.shortuuid)
+    checked = changed = expired = rejected = errors = 0
+    started = time.monotonic()
+    
+    with ThreadPoolExecutor(max_workers=payment_handler_max_workers) as executor:
+        registrations_iterator = registrations.iterator(chunk_size=payment_handler_chunk_size)
+        while chunk := list(islice(registrations_iterator, payment_handler_chunk_size)):
+            changed_registrations, rescheduled_registrations, registrations_to_reject = [], [], []
+            
+            payment_statuses_by_bill = provider.bulk_check(
+                [registration.shortuuid for registration in chunk], executor=executor
+            )
+            for registration in chunk:
+                payment_status = payment_statuses_by_bill[registration.shortuuid]
+                if isinstance(payment_status, Exception):
+                    error = payment_status
+                    errors += 1
+                    result += f'\nRegistration payment with id: {registration.shortuuid} check failed: {error!r}. '
+                    registration.schedule_next_payment_check(now)
+                    rescheduled_registrations.append(registration)
+                    continue
+                checked += 1
+                
+                # Счет с истекшим временем жизни помечается истекшим только после последней проверки через API, 
+                # чтобы не потерять оплату, прошедшую незадолго до истечения счета
+                if payment_status in (payment_statuses.CREATED, payment_statuses.WAITING) and registration.is_payment_expired(now):
+                    result += f'\nRegistration payment with id: {registration.shortuuid} have expired. '
+                    payment_status = payment_statuses.EXPIRED
+                    expired += 1
+                
+                if registration.payment_status != payment_status:
+                    result += f'\nRegistration payment with id: {registration.shortuuid} have new payment status {registration.payment_status} -> {payment_status}. '
+                    changed_registrations.append((registration, registration.payment_status))
+                    if payment_status == payment_statuses.WAITING:
+                        # Пользователь начал оплату - проверки снова становятся частыми
+                        registration.payment_check_attempts = 0
+                        registration.schedule_next_payment_check(now)
+                    registration.payment_status = payment_status
+                    if payment_status == payment_statuses.PAID:
+                        registration.is_registration_confirmed = True
+                else:
+                    registration.schedule_next_payment_check(now)
+                    rescheduled_registrations.append(registration)
+                if payment_status in (payment_statuses.REJECTED, payment_statuses.EXPIRED):
+                    registrations_to_reject.append(registration)
+            
+            if changed_registrations:
+                # Регистрации, статус которых уже изменило уведомление QIWI, не сохраняются и не отклоняются повторно
+                applied_ids = {registration.pk for registration in apply_payment_statuses(changed_registrations)}
+                changed += len(applied_ids)
+                for registration, _ in changed_registrations:
+                    if registration.pk not in applied_ids:
+                        result += f'\nRegistration payment with id: {registration.shortuuid} have been updated by notification. '
+                registrations_to_reject = [
+                    registration for registration in registrations_to_reject if registration.pk in applied_ids
+                ]
+            if rescheduled_registrations:
+                PaidEventRegistrations.objects.bulk_update(
+                    rescheduled_registrations, ['next_check_at', 'payment_check_attempts']
+                )
+            
+            for registration, future in zip(
+                registrations_to_reject, 
+                [executor.submit(provider.reject, registration.shortuuid) for registration in registrations_to_reject]
+            ):
+                try:
+                    future.result()
+                except Exception as error:
+                    errors += 1
+                    result += f'\nRegistration payment with id: {registration.shortuuid} reject failed: {error!r}. '
+                    continue
+                rejected += 1
                 result += f'Registration payment with id: {registration.shortuuid} have been deleted. '
-        return result if result != "" else "Waiting for new payment statuses..."
-    else:
+    
+    if checked == 0 and expired == 0 and errors == 0:
         return "No payments to handle for now..."
     
+    duration = time.monotonic() - started
+    metrics = (
+        f'Checked: {checked}, changed: {changed}, expired: {expired}, rejected: {rejected}, errors: {errors}, '
+        f'duration: {duration:.2f}s, throughput: {checked / duration if duration else 0:.1f} bills/s.'
+    )
+    return (result if result != "" else "\nWaiting for new payment statuses...") + f"\n{metrics}"
+    
+def get_reminder_registrations(registration_type, days):
+    """ Подтвержденные (для платных мероприятий - оплаченные) регистрации на мероприятия, 
+    которые начнутся через days дней, без уже отправленных напоминаний """
+    registration_model, _ = reminder_registrations[registration_type]
+    
+    # Диапазон вместо start_datetime__date, чтобы фильтр мог использовать индекс
+    day_start = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=days), datetime.min.time()))
+    return registration_model.objects.filter(
+        registration_model.confirmed_visitor_filter,
+        event__start_datetime__gte=day_start,
+        event__start_datetime__lt=day_start + timedelta(days=1),
+    ).exclude(
+        Exists(SentReminders.objects.filter(
+            registration_type=registration_type, registration_id=OuterRef('pk'), days_before=days
+        ))
+    )
+
+
 @shared_task
 def send_registration_reminder():
-    """Уведомление о предстоящем мероприятии"""
+    """Планировщик уведомлений о предстоящих мероприятиях 
+    
+    Регистрации всех типов разбиваются на пачки по REMINDER_CHUNK_SIZE, каждая пачка отправляется отдельной задачей """
     assert notification_days_before_events is not None, (f"Set NOTIFICATION_DAYS_BEFORE_EVENTS setting!")
     
-    for days in notification_days_before_events:
-        date_to_check = timezone.now() + timedelta(days=days)
-        registrations = EventRegistrations.objects.filter(event__start_datetime__date=date_to_check)
+    chunks = []
+    for registration_type in reminder_registrations:
+        for days in notification_days_before_events:
+            registration_ids = get_reminder_registrations(registration_type, days).order_by('id').values_list(
+                'id', flat=True
+            ).iterator(chunk_size=reminder_chunk_size)
+            while chunk := list(islice(registration_ids, reminder_chunk_size)):
+                chunks.append(send_registration_reminders_chunk.s(registration_type, days, chunk))
+    
+    if not chunks:
+        return "No reminders to send for now..."
+    group(chunks).apply_async()
+    return f"Reminder tasks have been planned: {len(chunks)}"
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_registration_reminders_chunk(self, registration_type, days, registration_ids):
+    """Уведомление о предстоящем мероприятии для пачки регистраций"""
+    registration_model, event_kind = reminder_registrations[registration_type]
+    
+    # Регистрации, напоминания которым уже отправлены (повторный запуск задачи), пропускаются
+    registrations = list(
+        get_reminder_registrations(registration_type, days).filter(id__in=registration_ids)
+        .select_related('user', 'event').only('shortuuid', 'user__email', 'event__name')
+    )
+    
+    def reminders():
         for registration in registrations:
-            user = registration.user
-            event = registration.event
-            subject = f'Напоминание о регистрации на мероприятие - {event.name} c №{registration.shortuuid}'
+            event_name = registration.event.name
+            subject = f'Напоминание о регистрации на {event_kind} - {event_name} c №{registration.shortuuid}'
             message = f"""
                 Здравствуйте! 
-                Вы зарегистрированы на мероприятие - {event.name}, которое пройдет через {days} дней. 
+                Вы зарегистрированы на {event_kind} - {event_name}, которое пройдет через {days} дней. 
                 Ждем Вас на мероприятии!
             """
-            send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email])
-            
+            yield subject, message, settings.EMAIL_HOST_USER, [registration.user.email]
+    
+    def record_reminder(index):
+        # Отправка записывается сразу после каждого письма, поэтому при повторе задачи 
+        # после ошибки уже доставленные напоминания не отправляются повторно
+        SentReminders.objects.bulk_create([SentReminders(
+            registration_type=registration_type, registration_id=registrations[index].id, days_before=days
+        )], ignore_conflicts=True)
+    
+    # Повторяется только упавшая пачка, а не вся рассылка
+    try:
+        sent = len(send_mass_email(reminders(), on_sent=record_reminder))
+    except Exception as error:
+        raise self.retry(exc=error)
+    return f"Reminders have been sent: {sent}"
+
 
 # Sending email notification when user registered for the event
 
@@ -131,8 +471,8 @@ def send_paid_registration_delete_notification(event_name, registration_shortuui
 
 # Sending email notification when the event is unavailable
 
-@shared_task
-def notify_event_cancellation(event_name, recipients):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def notify_event_cancellation(self, event_name, recipients):
     """Уведомление об отмене мероприятия"""
     subject = f"Мероприятие {event_name} отменено!"
     message = f"""
@@ -140,11 +480,11 @@ def notify_event_cancellation(event_name, recipients):
         Пожалуйста, обратитесь к организаторам мероприятия за дополнительной информацией. 
         :(
     """
-    send_mail(subject, message, settings.EMAIL_HOST_USER, recipients)
+    send_to_recipients(self, subject, message, recipients, event_name=event_name)
     
 
-@shared_task
-def notify_private_event_cancellation(event_name, recipients):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def notify_private_event_cancellation(self, event_name, recipients):
     """Уведомление об отмене приватного мероприятия"""
     subject = f"Приватное мероприятие {event_name} отменено!"
     message = f"""
@@ -152,11 +492,11 @@ def notify_private_event_cancellation(event_name, recipients):
         Пожалуйста, обратитесь к организаторам мероприятия за дополнительной информацией. 
         :(
     """
-    send_mail(subject, message, settings.EMAIL_HOST_USER, recipients)
+    send_to_recipients(self, subject, message, recipients, event_name=event_name)
     
 
-@shared_task
-def notify_paid_event_cancellation(event_name, recipients):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def notify_paid_event_cancellation(self, event_name, recipients):
     """Уведомление об отмене платного мероприятия"""
     subject = f"Платное мероприятие {event_name} отменено!"
     message = f"""
@@ -165,4 +505,37 @@ def notify_paid_event_cancellation(event_name, recipients):
         Пожалуйста, обратитесь к организаторам мероприятия за дополнительной информацией. 
         :(
     """
-    send_mail(subject, message, settings.EMAIL_HOST_USER, recipients)
\ No newline at end of file
+    send_to_recipients(self, subject, message, recipients, event_name=event_name)
+
+
+# Transactional outbox relay (see events.outbox)
+
+@shared_task
+def relay_outbox_messages(message_ids=None):
+    """Передача задач из outbox в брокер (без message_ids - всех сообщений, которые еще не переданы)"""
+    relayed = 0
+    while True:
+        # Сообщения, которые передает другой обработчик, и отложенные сообщения пропускаются
+        with transaction.atomic():
+            messages = OutboxMessages.objects.select_for_update(skip_locked=True).filter(
+                relay_error__isnull=True
+            ).order_by('id')
+            if message_ids is not None:
+                messages = messages.filter(id__in=message_ids)
+            messages = list(messages[:outbox_batch_size])
+            if not messages:
+                break
+            relayed_ids = []
+            for message in messages:
+                task = current_app.tasks.get(message.task_name)
+                if task is None:
+                    # Задача переименована или удалена: сообщение откладывается, чтобы не задерживать остальные
+                    logger.error("Outbox message %s is set aside: unknown task %s", message.pk, message.task_name)
+                    message.relay_error = f"Unknown task: {message.task_name}"
+                    message.save(update_fields=('relay_error', ))
+                    continue
+                task.apply_async(kwargs=message.kwargs)
+                relayed_ids.append(message.id)
+            OutboxMessages.objects.filter(id__in=relayed_ids).delete()
+        relayed += len(relayed_ids)
+    return f"Outbox messages have been relayed: {relayed}"
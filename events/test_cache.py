@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from . import cache as events_cache
+from .cache import get_many_or_compute, get_or_compute
+
+
+class StampedeProtectionTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.computations = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        cache.clear()
+
+    def slow_compute(self):
+        with self.lock:
+            self.computations += 1
+        time.sleep(0.2)
+        return 'value'
+
+    def test_concurrent_misses_compute_once(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: get_or_compute('key', self.slow_compute), range(10)))
+
+        self.assertEqual(results, ['value'] * 10)
+        self.assertEqual(self.computations, 1)
+
+    def test_stale_value_served_while_recomputing(self):
+        get_or_compute('key', lambda: 'old value', timeout=0)
+
+        # Другой запрос уже пересчитывает значение
+        self.assertTrue(events_cache.acquire_lock('key'))
+        self.assertEqual(get_or_compute('key', self.slow_compute), 'old value')
+        self.assertEqual(self.computations, 0)
+
+        events_cache.release_locks(['key'])
+        self.assertEqual(get_or_compute('key', self.slow_compute), 'value')
+        self.assertEqual(self.computations, 1)
+
+    def test_fresh_value_not_recomputed(self):
+        with mock.patch.object(events_cache, 'caching_early_refresh_beta', 0):
+            get_or_compute('key', lambda: 'value', timeout=60)
+            self.assertEqual(get_or_compute('key', self.slow_compute), 'value')
+        self.assertEqual(self.computations, 0)
+
+    def test_compute_only_missing_keys(self):
+        get_or_compute('key1', lambda: 'value1', timeout=60)
+
+        computed_keys = []
+        def compute_many(keys):
+            computed_keys.extend(keys)
+            return {key: key.replace('key', 'value') for key in keys if key != 'key3'}
+
+        with mock.patch.object(events_cache, 'caching_early_refresh_beta', 0):
+            values = get_many_or_compute(['key1', 'key2', 'key3'], compute_many)
+
+        self.assertEqual(computed_keys, ['key2', 'key3'])
+        self.assertEqual(values, {'key1': 'value1', 'key2': 'value2'})
+        # Блокировки освобождаются после пересчета
+        self.assertTrue(events_cache.acquire_lock('key3'))
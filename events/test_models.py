@@ -1,12 +1,25 @@
 from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from .indexes import has_trigram_extension
 from .models import (EventRegistrations, Events, EventTypes, EventVenues,
+                     OutboxMessages, PaidEventRegistrations, PaidEvents,
                      PrivateEventRegistrations, PrivateEvents)
+from .tasks import (create_registration_bill, notify_event_cancellation,
+                    notify_paid_event_cancellation,
+                    send_private_registration_notification,
+                    send_registration_delete_notification,
+                    send_registration_notification)
 
 
 class EventsModelsTest(TestCase):
@@ -228,4 +241,461 @@ class EventRegistrationsTest(TestCase):
         event_reg = EventRegistrations.objects.create(
             event=self.event, user=self.user, inviting_user=inviting_user
         )
-        self.assertEqual(event_reg.inviting_user, inviting_user)
\ No newline at end of file
+        self.assertEqual(event_reg.inviting_user, inviting_user)
+
+
+class ConfirmedVisitorsCountTest(TestCase):
+    
+    def setUp(self):
+        self.user = get_user_model().objects.create(
+            username='user@test.com',
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.user2 = get_user_model().objects.create(
+            username='user2@test.com',
+            email='user2@test.com',
+            password='testpass123'
+        )
+        self.event = Events.objects.create(
+            name='test event',
+            start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        self.paid_event = PaidEvents.objects.create(
+            name='test paid event',
+            start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        
+    def test_registration_create_confirm_delete(self):
+        registration = EventRegistrations.objects.create(event=self.event, user=self.user)
+        EventRegistrations.objects.create(event=self.event, user=self.user2, is_registration_confirmed=True)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 1)
+        
+        registration = EventRegistrations.objects.get(pk=registration.pk)
+        registration.is_registration_confirmed = True
+        registration.save()
+        registration.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 2)
+        self.assertEqual(self.event.confirmed_visitors_count, self.event.visitors_len())
+        
+        registration.delete()
+        EventRegistrations.objects.filter(user=self.user2).delete()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 0)
+        
+    def test_paid_registration_payment_status_change(self):
+        registration = PaidEventRegistrations.objects.create(
+            event=self.paid_event, user=self.user, is_registration_confirmed=False
+        )
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 0)
+        
+        registration.payment_status = PaidEventRegistrations.PaymentStatuses.PAID
+        registration.is_registration_confirmed = True
+        registration.save()
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 1)
+        
+        registration.payment_status = PaidEventRegistrations.PaymentStatuses.REJECTED
+        registration.save()
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 0)
+        
+    def test_stale_registration_copies(self):
+        registration = EventRegistrations.objects.create(event=self.event, user=self.user)
+        first_copy = EventRegistrations.objects.get(pk=registration.pk)
+        second_copy = EventRegistrations.objects.get(pk=registration.pk)
+        
+        # Изменение считается по состоянию в бд, а не по состоянию загруженного объекта
+        first_copy.is_registration_confirmed = second_copy.is_registration_confirmed = True
+        first_copy.save()
+        second_copy.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 1)
+        
+        first_copy.delete()
+        second_copy.delete()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 0)
+    
+    def test_partially_loaded_registrations(self):
+        EventRegistrations.objects.create(event=self.event, user=self.user, is_registration_confirmed=True)
+        EventRegistrations.objects.create(event=self.event, user=self.user2, is_registration_confirmed=True)
+        
+        # Загрузка и сохранение без полей условия подтверждения не требуют дополнительных запросов
+        with self.assertNumQueries(1):
+            registrations = list(EventRegistrations.objects.only('shortuuid'))
+        with CaptureQueriesContext(connection) as queries:
+            registrations[0].save(update_fields=['updated'])
+        self.assertFalse([query for query in queries if 'is_registration_confirmed' in query['sql']])
+        
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 2)
+        
+    def test_event_save_keeps_visitors_count(self):
+        event = Events.objects.get(pk=self.event.pk)
+        EventRegistrations.objects.create(event=self.event, user=self.user, is_registration_confirmed=True)
+        
+        event.max_visitors = 5
+        event.save()
+        event.refresh_from_db()
+        self.assertEqual(event.confirmed_visitors_count, 1)
+        
+    def test_recount_confirmed_visitors_command(self):
+        EventRegistrations.objects.create(event=self.event, user=self.user, is_registration_confirmed=True)
+        Events.objects.update(confirmed_visitors_count=10)
+        
+        call_command('recount_confirmed_visitors', stdout=StringIO())
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 1)
+
+
+class EventFilterIndexesTest(TestCase):
+    
+    def setUp(self):
+        Events.objects.bulk_create([
+            Events(
+                name=f'test event {i}', start_datetime=timezone.now() + timedelta(days=1),
+                closing_registration_date=timezone.now() + timedelta(hours=1)
+            )
+            for i in range(100)
+        ])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE "{Events._meta.db_table}"')
+                # На маленьких таблицах последовательное чтение всегда дешевле
+                cursor.execute('SET LOCAL enable_seqscan = off')
+    
+    def test_name_search_index(self):
+        plan = Events.objects.filter(name__iexact='TEST EVENT 42').order_by().explain()
+        self.assertIn('events_name_search_idx', plan, plan)
+        self.assertEqual(Events.objects.filter(name__iexact='TEST EVENT 42').count(), 1)
+    
+    @skipUnless(connection.vendor == 'postgresql', "pg_trgm is available on Postgres only")
+    def test_name_search_trigram_index(self):
+        if not has_trigram_extension(connection):
+            self.skipTest("pg_trgm extension is not installed")
+        plan = Events.objects.filter(name__icontains='EVENT 4').order_by().explain()
+        self.assertIn('events_name_search_idx', plan, plan)
+
+
+class BenchmarkEventFiltersCommandTest(TestCase):
+    
+    def test_benchmark_event_filters_command(self):
+        event = Events.objects.create(
+            name='Test Event', start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        stdout = StringIO()
+        call_command('benchmark_event_filters', events=100, batch_size=30, repeat=1, stdout=stdout)
+        
+        self.assertIn('Создано мероприятий: 100', stdout.getvalue())
+        self.assertIn('start_datetime__gte/lte', stdout.getvalue())
+        # Сгенерированные мероприятия удаляются после замера
+        self.assertEqual(list(Events.objects.all()), [event])
+
+
+class EventCancellationNotificationTest(TestCase):
+    
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create(
+                username=f'user{i}@test.com',
+                email=f'user{i}@test.com',
+                password='testpass123'
+            )
+            for i in range(5)
+        ]
+        event_data = {
+            'start_datetime': timezone.now() + timedelta(days=1),
+            'closing_registration_date': timezone.now() + timedelta(hours=1)
+        }
+        self.events = [Events.objects.create(name=f'test event {i}', **event_data) for i in range(2)]
+        self.paid_event = PaidEvents.objects.create(name='test paid event', **event_data)
+        
+        for event in self.events:
+            for user in self.users[:4]:
+                EventRegistrations.objects.create(event=event, user=user, is_registration_confirmed=True)
+            EventRegistrations.objects.create(event=event, user=self.users[4], is_registration_confirmed=False)
+        PaidEventRegistrations.objects.create(
+            event=self.paid_event, user=self.users[0], is_registration_confirmed=True,
+            payment_status=PaidEventRegistrations.PaymentStatuses.PAID
+        )
+        PaidEventRegistrations.objects.create(event=self.paid_event, user=self.users[1], is_registration_confirmed=True)
+        OutboxMessages.objects.all().delete()
+    
+    def get_outbox_messages(self, task):
+        return list(OutboxMessages.objects.filter(task_name=task.name))
+    
+    def test_bulk_event_deletion(self):
+        with mock.patch('events.signals.cancellation_notification_chunk_size', 3):
+            Events.objects.filter(pk__in=[event.pk for event in self.events]).delete()
+        
+        # Получатели собраны до каскадного удаления регистраций и разбиты на пачки
+        messages = self.get_outbox_messages(notify_event_cancellation)
+        self.assertEqual(
+            [(message.kwargs['event_name'], len(message.kwargs['recipients'])) for message in messages],
+            [('test event 0', 3), ('test event 0', 1), ('test event 1', 3), ('test event 1', 1)]
+        )
+        self.assertEqual(
+            sorted(sum((message.kwargs['recipients'] for message in messages[:2]), [])),
+            [user.email for user in self.users[:4]]
+        )
+    
+    def test_paid_event_deletion(self):
+        self.paid_event.delete()
+        
+        # Только оплаченные регистрации
+        messages = self.get_outbox_messages(notify_paid_event_cancellation)
+        self.assertEqual([message.kwargs['recipients'] for message in messages], [[self.users[0].email]])
+    
+    def test_cascade_deletion_skips_registrations_processing(self):
+        first_event, second_event = self.events
+        for i in range(5, 10):
+            EventRegistrations.objects.create(
+                event=second_event, is_registration_confirmed=True,
+                user=get_user_model().objects.create(username=f'user{i}@test.com', email=f'user{i}@test.com')
+            )
+        OutboxMessages.objects.all().delete()
+        
+        # Кол-во запросов не зависит от кол-ва регистраций мероприятия
+        with CaptureQueriesContext(connection) as first_event_queries:
+            first_event.delete()
+        with CaptureQueriesContext(connection) as second_event_queries:
+            second_event.delete()
+        self.assertEqual(len(first_event_queries), len(second_event_queries))
+        
+        self.assertFalse(self.get_outbox_messages(send_registration_delete_notification))
+        self.assertEqual(len(self.get_outbox_messages(notify_event_cancellation)), 2)
+    
+    def test_registration_deletion_notification(self):
+        EventRegistrations.objects.filter(event=self.events[0], user=self.users[0]).delete()
+        
+        messages = self.get_outbox_messages(send_registration_delete_notification)
+        self.assertEqual([message.kwargs['user_email'] for message in messages], [self.users[0].email])
+        self.events[0].refresh_from_db()
+        self.assertEqual(self.events[0].confirmed_visitors_count, 3)
+
+
+class WaitlistPromotionTest(TestCase):
+    
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create(
+                username=f'user{i}@test.com',
+                email=f'user{i}@test.com',
+                password='testpass123'
+            )
+            for i in range(3)
+        ]
+        event_data = {
+            'start_datetime': timezone.now() + timedelta(days=1),
+            'closing_registration_date': timezone.now() + timedelta(hours=1),
+            'max_visitors': 1,
+        }
+        self.event = Events.objects.create(name='test event', **event_data)
+        self.private_event = PrivateEvents.objects.create(name='test private event', **event_data)
+        self.paid_event = PaidEvents.objects.create(name='test paid event', price=100, **event_data)
+        
+        # Первый пользователь занимает единственное место, остальные в листе ожидания
+        EventRegistrations.objects.create(event=self.event, user=self.users[0], is_registration_confirmed=True)
+        PrivateEventRegistrations.objects.create(
+            event=self.private_event, user=self.users[0], is_registration_confirmed=True
+        )
+        PaidEventRegistrations.objects.create(
+            event=self.paid_event, user=self.users[0], is_registration_confirmed=True,
+            payment_status=PaidEventRegistrations.PaymentStatuses.PAID
+        )
+        for event, registration_model in (
+            (self.event, EventRegistrations),
+            (self.private_event, PrivateEventRegistrations),
+            (self.paid_event, PaidEventRegistrations),
+        ):
+            for position, user in enumerate(self.users[1:], start=1):
+                registration_model.objects.create(event=event, user=user, waitlist_position=position)
+        OutboxMessages.objects.all().delete()
+    
+    def get_outbox_messages(self, task):
+        return list(OutboxMessages.objects.filter(task_name=task.name))
+    
+    def get_confirmed_users(self, registration_model, event):
+        return list(registration_model.objects.filter(
+            event=event, waitlist_position__isnull=True
+        ).order_by('user').values_list('user', flat=True))
+    
+    def test_promotion_on_admin_deletion(self):
+        # Удаление через QuerySet.delete() (как в админке)
+        EventRegistrations.objects.filter(event=self.event, user=self.users[0]).delete()
+        
+        self.assertEqual(self.get_confirmed_users(EventRegistrations, self.event), [self.users[1].pk])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 1)
+        
+        # Переведенный из листа ожидания пользователь получает уведомление о регистрации
+        promoted = EventRegistrations.objects.get(event=self.event, user=self.users[1])
+        messages = self.get_outbox_messages(send_registration_notification)
+        self.assertEqual([message.kwargs['registration_shortuuid'] for message in messages], [promoted.shortuuid])
+    
+    def test_promotion_on_user_deletion(self):
+        self.users[0].delete()
+        
+        self.assertEqual(self.get_confirmed_users(EventRegistrations, self.event), [self.users[1].pk])
+        self.assertEqual(self.get_confirmed_users(PrivateEventRegistrations, self.private_event), [self.users[1].pk])
+        self.assertEqual(len(self.get_outbox_messages(send_private_registration_notification)), 1)
+    
+    def test_promotion_on_max_visitors_increase(self):
+        self.event.max_visitors = 2
+        self.event.save()
+        
+        self.assertEqual(
+            self.get_confirmed_users(EventRegistrations, self.event), [self.users[0].pk, self.users[1].pk]
+        )
+        self.assertEqual(EventRegistrations.objects.get(event=self.event, user=self.users[2]).waitlist_position, 2)
+        
+        # Без ограничения мест переводится весь лист ожидания
+        self.event.max_visitors = 0
+        self.event.save()
+        self.assertEqual(len(self.get_confirmed_users(EventRegistrations, self.event)), 3)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, 3)
+    
+    def test_paid_promotion_creates_bill_in_task(self):
+        with mock.patch('config.payments.FakePaymentProvider.create_bill') as create_bill:
+            PaidEventRegistrations.objects.filter(event=self.paid_event, user=self.users[0]).delete()
+        
+        # Счет создается задачей, а не в транзакции удаления чужой регистрации
+        create_bill.assert_not_called()
+        promoted = PaidEventRegistrations.objects.get(event=self.paid_event, user=self.users[1])
+        self.assertIsNone(promoted.waitlist_position)
+        self.assertFalse(promoted.is_registration_confirmed)
+        messages = self.get_outbox_messages(create_registration_bill)
+        self.assertEqual([message.kwargs for message in messages], [{'registration_id': promoted.pk}])
+        
+        # Место с неоплаченным счетом занято, следующий в листе ожидания остается в нем
+        self.assertEqual(
+            PaidEventRegistrations.objects.get(event=self.paid_event, user=self.users[2]).waitlist_position, 2
+        )
+
+    
+    def test_paid_promotion_on_unpaid_bill(self):
+        payment_statuses = PaidEventRegistrations.PaymentStatuses
+        registration = PaidEventRegistrations.objects.get(event=self.paid_event, user=self.users[0])
+        registration.payment_status = payment_statuses.CREATED
+        registration.is_registration_confirmed = False
+        registration.save()
+        
+        # Место с неоплаченным счетом занято
+        self.assertEqual(self.get_confirmed_users(PaidEventRegistrations, self.paid_event), [self.users[0].pk])
+        
+        # Истекший счет освобождает место для первого в листе ожидания
+        registration.payment_status = payment_statuses.EXPIRED
+        registration.save(update_fields=('payment_status', 'updated'))
+        
+        self.assertEqual(
+            self.get_confirmed_users(PaidEventRegistrations, self.paid_event), [self.users[0].pk, self.users[1].pk]
+        )
+        promoted = PaidEventRegistrations.objects.get(event=self.paid_event, user=self.users[1])
+        messages = self.get_outbox_messages(create_registration_bill)
+        self.assertEqual([message.kwargs for message in messages], [{'registration_id': promoted.pk}])
+        self.assertEqual(
+            PaidEventRegistrations.objects.get(event=self.paid_event, user=self.users[2]).waitlist_position, 2
+        )
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN plans are checked on Postgres only")
+class RegistrationIndexesTest(TestCase):
+    
+    def setUp(self):
+        event_data = {
+            'start_datetime': timezone.now() + timedelta(days=1),
+            'closing_registration_date': timezone.now() + timedelta(hours=1)
+        }
+        self.events = [Events.objects.create(name=f'test event {i}', **event_data) for i in range(10)]
+        self.private_events = [PrivateEvents.objects.create(name=f'test private event {i}', **event_data) for i in range(10)]
+        self.paid_events = [PaidEvents.objects.create(name=f'test paid event {i}', **event_data) for i in range(10)]
+        self.users = get_user_model().objects.bulk_create([
+            get_user_model()(username=f'user{i}@test.com', email=f'user{i}@test.com') for i in range(500)
+        ])
+        
+        for registration_model, events, extra_fields in (
+            (EventRegistrations, self.events, {}),
+            (PrivateEventRegistrations, self.private_events, {}),
+            (PaidEventRegistrations, self.paid_events, {'payment_status': PaidEventRegistrations.PaymentStatuses.PAID}),
+        ):
+            registration_model.objects.bulk_create([
+                registration_model(
+                    event=event, user=user, shortuuid=f'{registration_model.__name__[:2]}{event.pk:04}{user.pk:04}',
+                    is_registration_confirmed=user.pk % 100 == 0, **extra_fields
+                )
+                for event in events for user in self.users
+            ])
+        
+        with connection.cursor() as cursor:
+            for registration_model in (EventRegistrations, PrivateEventRegistrations, PaidEventRegistrations):
+                cursor.execute(f'ANALYZE "{registration_model._meta.db_table}"')
+            # На маленьких таблицах последовательное чтение всегда дешевле, 
+            # поэтому проверяется, что индекс может быть использован запросом
+            cursor.execute('SET LOCAL enable_seqscan = off')
+    
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+    
+    def test_confirmed_registrations_of_event(self):
+        self.assertUsesIndex(
+            EventRegistrations.objects.filter(event=self.events[0], is_registration_confirmed=True),
+            'event_confirmed_idx'
+        )
+        self.assertUsesIndex(
+            PrivateEventRegistrations.objects.filter(event=self.private_events[0], is_registration_confirmed=True),
+            'private_event_confirmed_idx'
+        )
+        self.assertUsesIndex(
+            PaidEventRegistrations.objects.filter(
+                event=self.paid_events[0], is_registration_confirmed=True,
+                payment_status=PaidEventRegistrations.PaymentStatuses.PAID
+            ),
+            'paid_event_confirmed_idx'
+        )
+    
+    def test_user_registrations(self):
+        for registration_model, index_name in (
+            (EventRegistrations, 'event_user_idx'),
+            (PrivateEventRegistrations, 'private_event_user_idx'),
+            (PaidEventRegistrations, 'paid_event_user_idx'),
+        ):
+            self.assertUsesIndex(
+                registration_model.objects.filter(user=self.users[0]).order_by('-id')[:10], index_name
+            )
+    
+    def test_pending_payments(self):
+        event = PaidEvents.objects.create(
+            name='test paid event', start_datetime=timezone.now() + timedelta(days=1), 
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        PaidEventRegistrations.objects.bulk_create([
+            PaidEventRegistrations(
+                event=event, user=user, shortuuid=f'pe{user.pk:08}', payment_link='https://pay.test/',
+                payment_status=PaidEventRegistrations.PaymentStatuses.WAITING
+            )
+            for user in self.users[:10]
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{PaidEventRegistrations._meta.db_table}"')
+        
+        # Запрос payment_handler
+        self.assertUsesIndex(
+            PaidEventRegistrations.objects.filter(
+                Q(next_check_at__isnull=True) | Q(next_check_at__lte=timezone.now()),
+                payment_status__in=(
+                    PaidEventRegistrations.PaymentStatuses.CREATED, PaidEventRegistrations.PaymentStatuses.WAITING
+                ),
+                waitlist_position__isnull=True,
+                payment_link__isnull=False
+            ).order_by(F('next_check_at').asc(nulls_first=True), 'id'),
+            'paid_pending_payment_idx'
+        )
+
@@ -0,0 +1,124 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import EventRegistrations, Events, OutboxMessages
+from .tasks import relay_outbox_messages, send_registration_notification
+
+
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        self.event = Events.objects.create(
+            name='test event',
+            start_datetime=timezone.now() + timedelta(days=3),
+            closing_registration_date=timezone.now() + timedelta(days=2)
+        )
+        self.users = [
+            get_user_model().objects.create(
+                username=f'user{i}@test.com',
+                email=f'user{i}@test.com',
+                password='testpass123'
+            )
+            for i in range(2)
+        ]
+
+    def register(self, user):
+        return EventRegistrations.objects.create(event=self.event, user=user, is_registration_confirmed=True)
+
+    def test_messages_not_relayed_on_commit_by_default(self):
+        with mock.patch('events.tasks.relay_outbox_messages.delay') as relay_delay, \
+             self.captureOnCommitCallbacks(execute=True):
+            self.register(self.users[0])
+
+        # Сообщение отправит периодическая задача, брокер при обработке запроса не используется
+        self.assertEqual(OutboxMessages.objects.count(), 1)
+        relay_delay.assert_not_called()
+
+    @mock.patch('events.outbox.outbox_relay_on_commit', True)
+    def test_messages_relayed_after_commit(self):
+        with mock.patch('events.tasks.relay_outbox_messages.delay') as relay_delay, \
+             self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                registrations = [self.register(user) for user in self.users]
+                # До коммита задачи не отправляются в брокер
+                relay_delay.assert_not_called()
+
+        # Сообщения транзакции передаются одной задачей
+        messages = list(OutboxMessages.objects.all())
+        self.assertEqual([message.task_name for message in messages], [send_registration_notification.name] * 2)
+        self.assertEqual(messages[0].kwargs['registration_shortuuid'], registrations[0].shortuuid)
+        relay_delay.assert_called_once_with([message.pk for message in messages])
+
+    @mock.patch('events.outbox.outbox_relay_on_commit', True)
+    def test_rolled_back_messages_are_not_saved(self):
+        with mock.patch('events.tasks.relay_outbox_messages.delay') as relay_delay, \
+             self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.register(self.users[0])
+                    raise ValueError
+            except ValueError:
+                pass
+
+        self.assertFalse(OutboxMessages.objects.exists())
+        relay_delay.assert_not_called()
+
+        # id сообщений отмененной транзакции не передаются со следующей
+        with mock.patch('events.tasks.relay_outbox_messages.delay') as relay_delay, \
+             self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.register(self.users[1])
+
+        relay_delay.assert_called_once_with([OutboxMessages.objects.get().pk])
+
+    @mock.patch('events.outbox.outbox_relay_on_commit', True)
+    def test_broker_failure_keeps_messages(self):
+        with mock.patch('events.tasks.relay_outbox_messages.delay', side_effect=ConnectionError), \
+             self.assertLogs('events.outbox', level='ERROR'), \
+             self.captureOnCommitCallbacks(execute=True):
+            self.register(self.users[0])
+
+        # Сообщение отправит периодическая задача
+        self.assertEqual(OutboxMessages.objects.count(), 1)
+
+    def test_relay_outbox_messages(self):
+        for user in self.users:
+            self.register(user)
+        first_message, second_message = OutboxMessages.objects.all()
+
+        with mock.patch('events.tasks.send_registration_notification.apply_async') as apply_async:
+            relay_outbox_messages([first_message.pk])
+            apply_async.assert_called_once_with(kwargs=first_message.kwargs)
+            self.assertEqual(list(OutboxMessages.objects.all()), [second_message])
+
+            # Без id передаются все оставшиеся сообщения
+            with mock.patch('events.tasks.outbox_batch_size', 1):
+                result = relay_outbox_messages()
+            apply_async.assert_called_with(kwargs=second_message.kwargs)
+
+        self.assertEqual(result, "Outbox messages have been relayed: 1")
+        self.assertFalse(OutboxMessages.objects.exists())
+
+    def test_unknown_task_does_not_block_relay(self):
+        unknown_message = OutboxMessages.objects.create(task_name='events.tasks.renamed_task', kwargs={})
+        self.register(self.users[0])
+        message = OutboxMessages.objects.get(task_name=send_registration_notification.name)
+
+        with mock.patch('events.tasks.send_registration_notification.apply_async') as apply_async, \
+             self.assertLogs('events.tasks', level='ERROR'):
+            result = relay_outbox_messages()
+
+        # Сообщение с неизвестной задачей откладывается, остальные передаются
+        apply_async.assert_called_once_with(kwargs=message.kwargs)
+        self.assertEqual(result, "Outbox messages have been relayed: 1")
+        unknown_message.refresh_from_db()
+        self.assertEqual(unknown_message.relay_error, 'Unknown task: events.tasks.renamed_task')
+        self.assertEqual(list(OutboxMessages.objects.all()), [unknown_message])
+
+        # Отложенное сообщение не передается повторно
+        self.assertEqual(relay_outbox_messages(), "Outbox messages have been relayed: 0")
@@ -0,0 +1,504 @@
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from extra_settings.models import Setting
+from rest_framework.test import APIClient
+
+from config.payments import (FakePaymentProvider, PaymentProvider,
+                             get_payment_provider)
+from config.qiwi import clear_QIWI_clients, get_QIWI_p2p
+
+from .models import (EventRegistrations, Events, OutboxMessages,
+                     PaidEventRegistrations, PaidEvents,
+                     PrivateEventRegistrations, PrivateEvents, SentReminders)
+from .tasks import (create_registration_bill, notify_event_cancellation,
+                    payment_handler, send_mass_email,
+                    send_paid_registration_notification,
+                    send_registration_reminder,
+                    send_registration_reminders_chunk)
+from .test_views import FakeQiwiNotifier
+
+payment_statuses = PaidEventRegistrations.PaymentStatuses
+
+
+class PaymentHandlerTest(TestCase):
+
+    def setUp(self):
+        self.paid_event = PaidEvents.objects.create(
+            name='test paid event',
+            start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        self.registrations = [
+            PaidEventRegistrations.objects.create(
+                event=self.paid_event,
+                payment_link=f'https://pay.test/{i}',
+                user=get_user_model().objects.create(
+                    username=f'user{i}@test.com',
+                    email=f'user{i}@test.com',
+                    password='testpass123'
+                )
+            )
+            for i in range(4)
+        ]
+        FakePaymentProvider.reset()
+
+    def tearDown(self):
+        FakePaymentProvider.reset()
+
+    def run_payment_handler(self, statuses):
+        for registration, status in zip(self.registrations, statuses):
+            FakePaymentProvider.set_status(registration.shortuuid, status)
+        return payment_handler()
+
+    def get_paid_notifications(self):
+        return list(OutboxMessages.objects.filter(
+            task_name=send_paid_registration_notification.name
+        ).values_list('kwargs', flat=True))
+
+    def get_rejected_bills(self):
+        return [
+            registration.shortuuid for registration in self.registrations
+            if FakePaymentProvider.bills.get(registration.shortuuid, {}).get('status') == payment_statuses.REJECTED
+        ]
+
+    def test_payment_statuses_update(self):
+        result = self.run_payment_handler([
+            payment_statuses.PAID,
+            payment_statuses.EXPIRED,
+            payment_statuses.WAITING,
+            ConnectionError('QIWI is unavailable'),
+        ])
+
+        paid, expired, waiting, failed = [
+            PaidEventRegistrations.objects.get(pk=registration.pk) for registration in self.registrations
+        ]
+        self.assertEqual(paid.payment_status, payment_statuses.PAID)
+        self.assertTrue(paid.is_registration_confirmed)
+        self.assertEqual(expired.payment_status, payment_statuses.EXPIRED)
+        self.assertEqual(waiting.payment_status, payment_statuses.WAITING)
+        self.assertEqual(failed.payment_status, payment_statuses.CREATED)
+        self.assertEqual(self.get_rejected_bills(), [expired.shortuuid])
+
+        # Действия сигналов, которые не вызывает bulk_update
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 1)
+        self.assertEqual(self.get_paid_notifications(), [{
+            'event_name': self.paid_event.name,
+            'registration_shortuuid': paid.shortuuid,
+            'user_email': paid.user.email
+        }])
+
+        self.assertIn('Checked: 3, changed: 3, expired: 0, rejected: 1, errors: 1', result)
+
+    def test_waitlist_promotion_on_expired_bill(self):
+        PaidEvents.objects.filter(pk=self.paid_event.pk).update(max_visitors=len(self.registrations))
+        waitlisted = PaidEventRegistrations.objects.create(
+            event=self.paid_event, waitlist_position=1,
+            user=get_user_model().objects.create(username='waitlisted@test.com', email='waitlisted@test.com')
+        )
+        
+        self.run_payment_handler([payment_statuses.EXPIRED] + [payment_statuses.WAITING] * 3)
+        
+        # Место истекшего счета занимает первый в листе ожидания, счет ему создает задача
+        waitlisted.refresh_from_db()
+        self.assertIsNone(waitlisted.waitlist_position)
+        self.assertEqual(
+            list(OutboxMessages.objects.filter(task_name=create_registration_bill.name).values_list('kwargs', flat=True)),
+            [{'registration_id': waitlisted.pk}]
+        )
+    
+    def test_never_scheduled_bills_checked_first(self):
+        scheduled = self.registrations[0]
+        PaidEventRegistrations.objects.filter(pk=scheduled.pk).update(
+            next_check_at=timezone.now() - timedelta(minutes=1)
+        )
+        bulk_check = FakePaymentProvider.bulk_check
+        checked_bill_ids = []
+        
+        def bulk_check_spy(provider, bill_ids, executor=None):
+            checked_bill_ids.extend(bill_ids)
+            return bulk_check(provider, bill_ids, executor)
+        
+        with mock.patch.object(FakePaymentProvider, 'bulk_check', bulk_check_spy):
+            self.run_payment_handler([payment_statuses.WAITING] * 4)
+        
+        # Счета без времени проверки идут первыми в любой бд (в Postgres NULL по умолчанию - в конце)
+        self.assertEqual(
+            checked_bill_ids,
+            [registration.shortuuid for registration in self.registrations[1:]] + [scheduled.shortuuid]
+        )
+    
+    def test_payment_checks_share_thread_pool(self):
+        with mock.patch('events.tasks.payment_handler_chunk_size', 1), \
+             mock.patch('events.tasks.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as handler_pool, \
+             mock.patch('config.payments.ThreadPoolExecutor') as provider_pool:
+            result = self.run_payment_handler([payment_statuses.WAITING] * 4)
+        
+        # Все пачки проверяются в одном пуле потоков обработчика
+        self.assertIn('Checked: 4', result)
+        handler_pool.assert_called_once()
+        provider_pool.assert_not_called()
+
+    @override_settings(QIWI_PRIVATE_KEY='test-secret-key')
+    def test_notification_during_payment_check(self):
+        paid = self.registrations[0]
+        notifier = FakeQiwiNotifier(APIClient(), 'test-secret-key')
+        bulk_check = FakePaymentProvider.bulk_check
+        
+        def bulk_check_with_notification(provider, bill_ids, executor=None):
+            # Уведомление об оплате приходит, пока обработчик проверяет статусы
+            response = notifier.notify(paid, payment_statuses.PAID, str(self.paid_event.price))
+            self.assertEqual(response.status_code, 200)
+            return bulk_check(provider, bill_ids, executor)
+        
+        with mock.patch.object(FakePaymentProvider, 'bulk_check', bulk_check_with_notification):
+            result = self.run_payment_handler([payment_statuses.PAID] + [payment_statuses.CREATED] * 3)
+        
+        # Оплата учитывается и подтверждается письмом один раз (письмо отправлено по уведомлению)
+        self.assertIn('Checked: 4, changed: 0', result)
+        self.assertIn(f'{paid.shortuuid} have been updated by notification', result)
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 1)
+        self.assertEqual(len(self.get_paid_notifications()), 1)
+        paid.refresh_from_db()
+        self.assertEqual(paid.payment_status, payment_statuses.PAID)
+    
+    def test_payment_checks_schedule(self):
+        now = timezone.now()
+        not_due, expired, due, _ = self.registrations
+        PaidEventRegistrations.objects.filter(pk=not_due.pk).update(next_check_at=now + timedelta(minutes=5))
+        PaidEventRegistrations.objects.filter(pk=expired.pk).update(
+            payment_expires_at=now - timedelta(minutes=1), next_check_at=now - timedelta(minutes=1)
+        )
+        PaidEventRegistrations.objects.filter(pk=due.pk).update(
+            payment_expires_at=now + timedelta(minutes=30), payment_check_attempts=3
+        )
+        
+        # Счета, время проверки которых не подошло, не проверяются через API, 
+        # истекший счет помечается истекшим и отклоняется после последней проверки
+        result = self.run_payment_handler([
+            AssertionError('Not due'), payment_statuses.CREATED, payment_statuses.CREATED, payment_statuses.CREATED
+        ])
+        self.assertIn('Checked: 3, changed: 1, expired: 1, rejected: 1, errors: 0', result)
+        self.assertEqual(self.get_rejected_bills(), [expired.shortuuid])
+        
+        not_due.refresh_from_db()
+        expired.refresh_from_db()
+        due.refresh_from_db()
+        self.assertEqual(not_due.payment_check_attempts, 0)
+        self.assertEqual(expired.payment_status, payment_statuses.EXPIRED)
+        
+        # Задержка до следующей проверки растет экспоненциально
+        self.assertEqual(due.payment_check_attempts, 4)
+        self.assertGreaterEqual(due.next_check_at, now + timedelta(seconds=30 * 2 ** 3))
+        
+        result = self.run_payment_handler([payment_statuses.CREATED] * 4)
+        self.assertEqual(result, "No payments to handle for now...")
+    
+    def test_expired_bill_paid_before_expiration(self):
+        paid, not_paid, failed, _ = self.registrations
+        PaidEventRegistrations.objects.filter(pk__in=[paid.pk, not_paid.pk, failed.pk]).update(
+            payment_expires_at=timezone.now() - timedelta(seconds=1), next_check_at=timezone.now() - timedelta(seconds=1)
+        )
+        
+        result = self.run_payment_handler([
+            payment_statuses.PAID, payment_statuses.WAITING, ConnectionError('QIWI is unavailable'), payment_statuses.CREATED
+        ])
+        self.assertIn('Checked: 3, changed: 2, expired: 1, rejected: 1, errors: 1', result)
+        
+        # Оплата, прошедшая перед истечением счета, не теряется
+        paid.refresh_from_db()
+        self.assertEqual(paid.payment_status, payment_statuses.PAID)
+        self.assertTrue(paid.is_registration_confirmed)
+        not_paid.refresh_from_db()
+        self.assertEqual(not_paid.payment_status, payment_statuses.EXPIRED)
+        self.assertEqual(self.get_rejected_bills(), [not_paid.shortuuid])
+        
+        # Счет, который не удалось проверить, проверяется повторно до пометки истекшим
+        failed.refresh_from_db()
+        self.assertEqual(failed.payment_status, payment_statuses.CREATED)
+        self.assertLessEqual(failed.next_check_at, timezone.now())
+    
+    def test_payment_check_delay(self):
+        now = timezone.now()
+        registration = self.registrations[0]
+        registration.start_payment_checks(lifetime=24 * 60, now=now)
+        self.assertEqual(registration.next_check_at, now + timedelta(seconds=30))
+        
+        for _ in range(10):
+            registration.schedule_next_payment_check(now)
+        self.assertEqual(registration.next_check_at, now + timedelta(seconds=settings.PAYMENT_CHECK_MAX_DELAY))
+        # Иначе каждый счет проверялся бы при каждом запуске payment_handler
+        self.assertGreater(settings.PAYMENT_CHECK_MAX_DELAY, settings.PAYMENT_CHECK_INTERVAL_MINUTES * 60)
+        
+        # Проверка не планируется позже истечения счета
+        registration.payment_expires_at = now + timedelta(minutes=1)
+        registration.schedule_next_payment_check(now)
+        self.assertEqual(registration.next_check_at, registration.payment_expires_at)
+    
+    def test_create_registration_bill(self):
+        registration = self.registrations[0]
+        PaidEventRegistrations.objects.filter(pk=registration.pk).update(payment_link=None)
+        
+        with mock.patch.object(FakePaymentProvider, 'create_bill', wraps=FakePaymentProvider().create_bill) as create_bill:
+            create_registration_bill(registration.pk)
+            # Повторный запуск задачи не создает второй счет
+            create_registration_bill(registration.pk)
+        
+        registration.refresh_from_db()
+        create_bill.assert_called_once()
+        self.assertEqual(list(FakePaymentProvider.bills), [registration.shortuuid])
+        self.assertIn(registration.shortuuid, registration.payment_link)
+        self.assertIsNotNone(registration.next_check_at)
+        self.assertIsNotNone(registration.payment_expires_at)
+    
+    def test_bills_without_link_are_not_checked(self):
+        registration = self.registrations[0]
+        PaidEventRegistrations.objects.filter(pk=registration.pk).update(
+            payment_link=None, updated=timezone.now() - timedelta(hours=1)
+        )
+        
+        with mock.patch('events.tasks.create_registration_bill.delay') as create_bill_delay:
+            result = self.run_payment_handler([
+                AssertionError('Bill is not created'), payment_statuses.CREATED, payment_statuses.CREATED, payment_statuses.CREATED
+            ])
+        
+        # Счет, который не удалось создать, создается повторно
+        create_bill_delay.assert_called_once_with(registration.pk)
+        self.assertIn('Checked: 3, changed: 0, expired: 0, rejected: 0, errors: 0', result)
+    
+    def test_no_pending_payments(self):
+        PaidEventRegistrations.objects.update(payment_status=payment_statuses.PAID)
+
+        result = self.run_payment_handler([])
+
+        self.assertEqual(result, "No payments to handle for now...")
+
+    @override_settings(FAKE_PAYMENT_PROVIDER_PAY_AFTER_CHECKS=2)
+    def test_fake_payment_provider_transitions(self):
+        provider = get_payment_provider()
+        self.assertIsInstance(provider, FakePaymentProvider)
+        
+        provider.create_bill('paid', amount=100, lifetime=30, comment='')
+        provider.create_bill('expired', amount=100, lifetime=0, comment='')
+        provider.create_bill('rejected', amount=100, lifetime=30, comment='')
+        self.assertEqual(provider.reject('rejected'), payment_statuses.REJECTED)
+        
+        self.assertEqual(provider.check('paid'), payment_statuses.WAITING)
+        self.assertEqual(
+            provider.bulk_check(['paid', 'expired', 'rejected']),
+            {'paid': payment_statuses.PAID, 'expired': payment_statuses.EXPIRED, 'rejected': payment_statuses.REJECTED}
+        )
+        
+        # Ошибки проверки счетов возвращаются вместо статусов
+        statuses = provider.bulk_check(['unknown'])
+        self.assertIsInstance(statuses['unknown'], LookupError)
+    
+    def test_payment_provider_interface(self):
+        class IncompletePaymentProvider(PaymentProvider):
+            def check(self, bill_id):
+                return payment_statuses.PAID
+        
+        with self.assertRaises(TypeError):
+            IncompletePaymentProvider()
+
+
+class MassEmailTest(TestCase):
+    
+    def test_mass_email_uses_one_connection(self):
+        datatuples = [
+            (f'Subject {i}', 'Message', 'from@example.com', [f'user{i}@test.com']) for i in range(5)
+        ]
+        with mock.patch('events.tasks.email_chunk_size', 2), \
+             mock.patch('events.tasks.get_connection', wraps=get_connection) as get_connection_mock:
+            sent = send_mass_email(datatuples)
+        
+        self.assertEqual(sent, [0, 1, 2, 3, 4])
+        self.assertEqual(len(mail.outbox), 5)
+        get_connection_mock.assert_called_once()
+    
+    def test_mass_email_rate_limit(self):
+        datatuples = [('Subject', 'Message', 'from@example.com', ['user@test.com'])] * 4
+        with mock.patch('events.tasks.email_chunk_size', 2), \
+             mock.patch('events.tasks.email_rate_limit', 2), \
+             mock.patch('events.tasks.time.sleep') as sleep:
+            send_mass_email(datatuples)
+        
+        # Пауза после каждой пачки: 2 письма при ограничении 2 письма в секунду
+        self.assertEqual(sleep.call_count, 2)
+        self.assertAlmostEqual(sleep.call_args_list[0].args[0], 1, places=1)
+    
+    def test_event_cancellation_letters(self):
+        recipients = ['first@test.com', 'second@test.com']
+        notify_event_cancellation('Test event', recipients)
+        
+        # Получатели не видят адреса друг друга
+        self.assertEqual([message.to for message in mail.outbox], [[recipient] for recipient in recipients])
+    
+    def test_event_cancellation_retries_remaining_recipients(self):
+        recipients = ['first@test.com', 'second@test.com', 'third@test.com']
+        with mock.patch('events.tasks.EmailMessage.send', side_effect=[1, ConnectionError('SMTP is unavailable')]), \
+             mock.patch.object(notify_event_cancellation, 'retry', side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                notify_event_cancellation('Test event', recipients)
+        
+        # Повторно письма отправляются только тем, кому они еще не отправлены
+        self.assertEqual(
+            retry.call_args.kwargs['kwargs'], {'event_name': 'Test event', 'recipients': recipients[1:]}
+        )
+
+
+class RegistrationReminderTest(TestCase):
+    
+    def setUp(self):
+        event_data = {
+            'start_datetime': timezone.now() + timedelta(days=3),
+            'closing_registration_date': timezone.now() + timedelta(days=2)
+        }
+        self.event = Events.objects.create(name='test event', **event_data)
+        self.private_event = PrivateEvents.objects.create(name='test private event', **event_data)
+        self.paid_event = PaidEvents.objects.create(name='test paid event', **event_data)
+        
+        users = [
+            get_user_model().objects.create(
+                username=f'user{i}@test.com',
+                email=f'user{i}@test.com',
+                password='testpass123'
+            )
+            for i in range(6)
+        ]
+        self.registrations = [
+            EventRegistrations.objects.create(event=self.event, user=user, is_registration_confirmed=True)
+            for user in users[:5]
+        ] + [
+            PrivateEventRegistrations.objects.create(event=self.private_event, user=users[0], is_registration_confirmed=True),
+            PaidEventRegistrations.objects.create(
+                event=self.paid_event, user=users[0], is_registration_confirmed=True, payment_status=payment_statuses.PAID
+            ),
+        ]
+        
+        # Неподтвержденные и неоплаченные регистрации не получают напоминаний
+        EventRegistrations.objects.create(event=self.event, user=users[5], is_registration_confirmed=False)
+        PrivateEventRegistrations.objects.create(event=self.private_event, user=users[5], is_registration_confirmed=False)
+        PaidEventRegistrations.objects.create(event=self.paid_event, user=users[5], is_registration_confirmed=True)
+    
+    def plan_reminders(self):
+        with mock.patch('events.tasks.reminder_chunk_size', 2), \
+             mock.patch('events.tasks.notification_days_before_events', (3, 1)), \
+             mock.patch('events.tasks.group') as group_mock:
+            result = send_registration_reminder()
+        signatures = list(group_mock.call_args.args[0]) if group_mock.called else []
+        return result, signatures
+    
+    def test_reminders_fan_out(self):
+        result, signatures = self.plan_reminders()
+        
+        # Регистрации разбиты на пачки, каждая пачка - отдельная задача
+        self.assertEqual(result, "Reminder tasks have been planned: 5")
+        self.assertEqual(
+            [(signature.args[0], len(signature.args[2])) for signature in signatures],
+            [('EVENT', 2), ('EVENT', 2), ('EVENT', 1), ('PRIVATE', 1), ('PAID', 1)]
+        )
+        
+        # Пачка отправляется без отдельных запросов пользователя и мероприятия для каждой регистрации 
+        # (запрос регистраций и запись об отправке каждого напоминания)
+        with self.assertNumQueries(3):
+            send_registration_reminders_chunk(*signatures[0].args)
+        for signature in signatures[1:]:
+            send_registration_reminders_chunk(*signature.args)
+        
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox), 
+            sorted(registration.user.email for registration in self.registrations)
+        )
+        self.assertTrue(any('платное мероприятие' in message.subject for message in mail.outbox))
+        self.assertEqual(SentReminders.objects.count(), 7)
+    
+    def test_reminders_are_sent_once(self):
+        _, signatures = self.plan_reminders()
+        for signature in signatures:
+            send_registration_reminders_chunk(*signature.args)
+        
+        # Повторный запуск задач и планировщика не отправляет напоминания повторно
+        for signature in signatures:
+            send_registration_reminders_chunk(*signature.args)
+        self.assertEqual(len(mail.outbox), 7)
+        
+        result, _ = self.plan_reminders()
+        self.assertEqual(result, "No reminders to send for now...")
+    
+    def test_reminders_retry_after_failure(self):
+        _, signatures = self.plan_reminders()
+        registration_type, days, registration_ids = signatures[0].args
+        
+        with mock.patch('events.tasks.EmailMessage.send', side_effect=[1, ConnectionError('SMTP is unavailable')]), \
+             mock.patch.object(send_registration_reminders_chunk, 'retry', side_effect=Retry):
+            with self.assertRaises(Retry):
+                send_registration_reminders_chunk(registration_type, days, registration_ids)
+        
+        # Доставленное до ошибки напоминание записано и не отправляется при повторе задачи
+        self.assertEqual(SentReminders.objects.count(), 1)
+        send_registration_reminders_chunk(registration_type, days, registration_ids)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(SentReminders.objects.count(), 2)
+    
+    def test_no_reminders(self):
+        with mock.patch('events.tasks.notification_days_before_events', (1,)), \
+             mock.patch('events.tasks.group') as group_mock:
+            result = send_registration_reminder()
+        
+        self.assertEqual(result, "No reminders to send for now...")
+        group_mock.assert_not_called()
+
+
+def make_QIWI_private_key(secret):
+    key_data = {
+        "version": "P2P", 
+        "data": {"payin_merchant_site_uid": "test-site", "user_id": "1", "secret": secret}
+    }
+    return base64.b64encode(json.dumps(key_data).encode()).decode()
+
+
+class QiwiClientsTest(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+    
+    def tearDown(self):
+        # Значения настроек из админки кэшируются extra_settings
+        cache.clear()
+        clear_QIWI_clients()
+    
+    @override_settings(QIWI_PRIVATE_KEY=make_QIWI_private_key('first'))
+    def test_client_reused_until_key_changes(self):
+        p2p = get_QIWI_p2p()
+        self.assertIsNotNone(p2p)
+        self.assertIs(get_QIWI_p2p(), p2p)
+        
+        # Изменение ключа в админке сбрасывает клиентов
+        Setting.objects.update_or_create(
+            name="QIWI_PRIVATE_KEY", 
+            defaults={"value_type": Setting.TYPE_TEXT, "value_text": make_QIWI_private_key('second')}
+        )
+        new_p2p = get_QIWI_p2p()
+        self.assertIsNot(new_p2p, p2p)
+        self.assertEqual(new_p2p.auth_key, make_QIWI_private_key('second'))
+        self.assertIs(get_QIWI_p2p(), new_p2p)
+    
+    @override_settings(QIWI_PRIVATE_KEY='invalid key')
+    def test_invalid_key(self):
+        with self.assertLogs('config.qiwi', level='ERROR'):
+            self.assertIsNone(get_QIWI_p2p())
@@ -1,15 +1,33 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import (TestCase, TransactionTestCase, override_settings,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.test import APIClient, APITestCase
 from rest_framework_simplejwt.tokens import AccessToken
 
-from .models import Events, PaidEvents, PrivateEvents
+from config.pagination import CountStrategyPaginator
+from config.payments import FakePaymentProvider
+from config.qiwi import get_QIWI_notification_signature
+
+from .cache import get_generation
+from .models import (EventRegistrations, Events, EventTypes, EventVenues,
+                     OutboxMessages, PaidEventRegistrations, PaidEvents,
+                     PrivateEvents)
 from .serializers import (EventsSerializer, PaidEventsSerializer,
                           PrivateEventsSerializer)
+from .tasks import create_registration_bill
+from .views import EventsViewSet
 
 
 class EventsViewSetTestCase(APITestCase):
@@ -72,6 +90,168 @@ class EventsViewSetTestCase(APITestCase):
         self.assertEqual(admin_response.status_code, status.HTTP_200_OK)
         self.assertEqual(anonymus_client_response.status_code, status.HTTP_200_OK)
         
+    def test_get_all_events_query_count(self):
+        with CaptureQueriesContext(connection) as small_page_queries:
+            response = self.client.get(self.events_list_url, {'page_size': 2})
+        self.assertEqual(len(response.data.get("results")), 2)
+        
+        # Количество запросов не должно зависеть от размера страницы
+        venue = EventVenues.objects.create(name='Test venue')
+        category = EventTypes.objects.create(name='Test category')
+        for i in range(10):
+            event = Events.objects.create(
+                name=f'Test event {i + 3}',
+                start_datetime=timezone.now() + timedelta(days=3),
+                closing_registration_date=timezone.now() + timedelta(hours=3),
+                venue=venue,
+                category=category
+            )
+            EventRegistrations.objects.create(event=event, user=self.user, is_registration_confirmed=True)
+            EventRegistrations.objects.create(event=event, user=self.admin_user, is_registration_confirmed=False)
+        
+        with CaptureQueriesContext(connection) as big_page_queries:
+            response = self.client.get(self.events_list_url, {'page_size': 12})
+        self.assertEqual(len(response.data.get("results")), 12)
+        self.assertEqual(len(response.data.get("results")[0].get("visitors")), 1)
+        self.assertEqual(response.data.get("results")[0].get("venue").get("name"), 'Test venue')
+        
+        self.assertEqual(len(small_page_queries), len(big_page_queries))
+        
+    def test_events_list_cache(self):
+        client_response = self.client.get(self.events_list_url, {'name__icontains': 'test'})
+        with CaptureQueriesContext(connection) as cached_list_queries:
+            anonymus_client_response = self.anonymus_client.get(self.events_list_url, {'name__icontains': 'test'})
+        
+        self.assertEqual(client_response.data.get("count"), 2)
+        self.assertEqual(anonymus_client_response.data.get("count"), 2)
+        self.assertEqual(len(cached_list_queries), 0)
+        
+        # Любая запись в модель меняет поколение и все страницы списка устаревают
+        Events.objects.create(
+            name='Test event 3',
+            start_datetime=timezone.now() + timedelta(days=3),
+            closing_registration_date=timezone.now() + timedelta(hours=3)
+        )
+        anonymus_client_response = self.anonymus_client.get(self.events_list_url, {'name__icontains': 'test'})
+        
+        self.assertEqual(anonymus_client_response.data.get("count"), 3)
+        self.assertEqual(anonymus_client_response.data.get("results")[0].get("name"), 'Test event 3')
+        
+    def test_events_detail_cache(self):
+        with CaptureQueriesContext(connection) as first_request_queries:
+            client_response = self.client.get(self.events_detail_url)
+        
+        # Закэшированное мероприятие общее для всех пользователей
+        with CaptureQueriesContext(connection) as second_request_queries:
+            admin_response = self.admin_client.get(self.events_detail_url)
+        with CaptureQueriesContext(connection) as anonymus_request_queries:
+            anonymus_client_response = self.anonymus_client.get(self.events_detail_url)
+        
+        self.assertEqual(client_response.data, admin_response.data)
+        self.assertLess(len(second_request_queries), len(first_request_queries))
+        # Из бд выбирается только ID мероприятия для проверки прав доступа
+        self.assertEqual(len(anonymus_request_queries), 1)
+        
+        # Данные пользователя добавляются отдельно от кэша
+        EventRegistrations.objects.create(event=self.event1, user=self.user, is_registration_confirmed=True)
+        client_response = self.client.get(self.events_detail_url)
+        admin_response = self.admin_client.get(self.events_detail_url)
+        
+        self.assertEqual(client_response.data.get("current_user_registration").get("user"), self.user.id)
+        self.assertIsNone(admin_response.data.get("current_user_registration"))
+        self.assertEqual(len(admin_response.data.get("visitors")), 1)
+        
+        # Изменение мероприятия инвалидирует кэш
+        self.event1.name = 'Updated test event'
+        self.event1.save()
+        anonymus_client_response = self.anonymus_client.get(self.events_detail_url)
+        
+        self.assertEqual(anonymus_client_response.data.get("name"), 'Updated test event')
+
+    def test_events_detail_cache_checks_permissions(self):
+        self.anonymus_client.get(self.events_detail_url)
+        
+        # Закэшированное мероприятие отдается только после проверок get_queryset и прав на объект
+        with mock.patch.object(EventsViewSet, 'check_object_permissions', side_effect=PermissionDenied):
+            response = self.anonymus_client.get(self.events_detail_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        with mock.patch.object(EventsViewSet, 'get_queryset', return_value=Events.objects.exclude(pk=self.event1.pk)):
+            response = self.anonymus_client.get(self.events_detail_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_events_list_cursor_pagination(self):
+        Events.objects.create(
+            name='Test event 3',
+            start_datetime=timezone.now() + timedelta(days=3),
+            closing_registration_date=timezone.now() + timedelta(hours=3)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.anonymus_client.get(self.events_list_url, {'cursor': '', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data.get("count"))
+        self.assertIsNone(response.data.get("total_pages"))
+        self.assertEqual(
+            [event.get("name") for event in response.data.get("results")], ['Test event 3', 'Test event 2']
+        )
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+        response = self.anonymus_client.get(response.data.get("next"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([event.get("name") for event in response.data.get("results")], ['Test event'])
+        self.assertIsNone(response.data.get("next"))
+        self.assertIsNotNone(response.data.get("previous"))
+
+    def test_events_detail_conditional_get(self):
+        response = self.client.get(self.events_detail_url)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        self.assertIsNotNone(etag)
+        self.assertIsNotNone(last_modified)
+
+        not_modified_response = self.client.get(self.events_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        not_modified_response = self.client.get(self.events_detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # ETag зависит от пользователя, так как в ответе есть его регистрация
+        admin_response = self.admin_client.get(self.events_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(admin_response.status_code, status.HTTP_200_OK)
+
+        # Регистрация на мероприятие изменяет его данные
+        EventRegistrations.objects.create(event=self.event1, user=self.user, is_registration_confirmed=True)
+        response = self.client.get(self.events_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers.get("ETag"), etag)
+
+    def test_events_list_conditional_get(self):
+        response = self.anonymus_client.get(self.events_list_url)
+        etag = response.headers.get("ETag")
+
+        with CaptureQueriesContext(connection) as not_modified_queries:
+            not_modified_response = self.anonymus_client.get(self.events_list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(not_modified_queries), 0)
+
+        self.event1.name = 'Updated test event'
+        self.event1.save()
+        response = self.anonymus_client.get(self.events_list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_events_list_last_modified_after_deletion(self):
+        response = self.anonymus_client.get(self.events_list_url)
+        last_modified = response.headers.get("Last-Modified")
+        
+        # Удаление мероприятия не меняет дату изменения остальных, но меняет поколение списка
+        with mock.patch('events.cache.time.time_ns', return_value=time.time_ns() + 5 * 10 ** 9):
+            self.event1.delete()
+        response = self.anonymus_client.get(self.events_list_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([event.get("id") for event in response.data.get("results")], [self.event2.id])
+        self.assertNotEqual(response.headers.get("Last-Modified"), last_modified)
+
     def test_events_detail_view(self):
         client_response = self.client.get(self.events_detail_url)
         admin_response = self.admin_client.get(self.events_detail_url)
@@ -396,6 +576,37 @@ class EventsRegistrationModelMixinTestCase(APITestCase):
         self.assertEqual(admin_response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(anonymus_client_response.status_code, status.HTTP_401_UNAUTHORIZED)
         
+    def test_event_registration_waitlist(self):
+        self.events_model.objects.filter(id=self.event1.id).update(max_visitors=1)
+        user2 = get_user_model().objects.create(username='user2@test.com', email='user2@test.com')
+        user2_client = APIClient()
+        user2_client.force_authenticate(user2)
+        
+        client_response = self.client.post(self.event_registration_url)
+        admin_response = self.admin_client.post(self.event_registration_url)
+        user2_response = user2_client.post(self.event_registration_url)
+        
+        self.assertEqual(client_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(client_response.data.get("waitlist_position"), None)
+        
+        # Мест нет - регистрации встают в лист ожидания
+        self.assertEqual(admin_response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(admin_response.data.get("is_registration_confirmed"), False)
+        self.assertEqual(admin_response.data.get("waitlist_position"), 1)
+        self.assertEqual(user2_response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(user2_response.data.get("waitlist_position"), 2)
+        
+        # Освободившееся место занимает первый в листе ожидания
+        self.client.delete(self.event_registration_url)
+        
+        admin_registration = EventRegistrations.objects.get(event=self.event1, user=self.admin_user)
+        self.assertTrue(admin_registration.is_registration_confirmed)
+        self.assertIsNone(admin_registration.waitlist_position)
+        self.assertEqual(EventRegistrations.objects.get(event=self.event1, user=user2).waitlist_position, 2)
+        
+        self.event1.refresh_from_db()
+        self.assertEqual(self.event1.confirmed_visitors_count, 1)
+        
     def test_delete_event_registration_view(self):
         self.client.post(self.event_registration_url)
         self.admin_client.post(self.event_registration_url)
@@ -419,6 +630,51 @@ class EventsRegistrationModelMixinTestCase(APITestCase):
         self.assertEqual(anonymus_client_response.status_code, status.HTTP_401_UNAUTHORIZED)
         
 
+@skipUnlessDBFeature('has_select_for_update')
+class EventsRegistrationConcurrencyTestCase(TransactionTestCase):
+    
+    max_visitors = 25
+    parallel_registrations = 200
+    
+    def setUp(self):
+        self.event = Events.objects.create(
+            name='Test event',
+            start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1),
+            max_visitors=self.max_visitors
+        )
+        self.event_registration_url = reverse('events-registration', args=[self.event.id])
+        self.users = [
+            get_user_model().objects.create(username=f'user{i}@test.com', email=f'user{i}@test.com')
+            for i in range(self.parallel_registrations)
+        ]
+        
+    def register(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        try:
+            return client.post(self.event_registration_url).status_code
+        finally:
+            connection.close()
+            
+    def test_parallel_registrations(self):
+        with ThreadPoolExecutor(max_workers=40) as executor:
+            status_codes = list(executor.map(self.register, self.users))
+        
+        self.assertEqual(status_codes.count(status.HTTP_201_CREATED), self.max_visitors)
+        self.assertEqual(status_codes.count(status.HTTP_202_ACCEPTED), self.parallel_registrations - self.max_visitors)
+        
+        # Позиции в листе ожидания уникальны и идут без пропусков
+        waitlist_positions = EventRegistrations.objects.filter(
+            event=self.event, waitlist_position__isnull=False
+        ).values_list('waitlist_position', flat=True)
+        self.assertEqual(sorted(waitlist_positions), list(range(1, self.parallel_registrations - self.max_visitors + 1)))
+        
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.confirmed_visitors_count, self.max_visitors)
+        self.assertEqual(self.event.visitors_len(), self.max_visitors)
+
+
 class EventsInvitationModelMixinTestCase(APITestCase):
     
     events_model = PrivateEvents
@@ -604,4 +860,286 @@ class EventsInvitationModelMixinTestCase(APITestCase):
         self.assertEqual(client_response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertEqual(admin_response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertEqual(anonymus_client_response.status_code, status.HTTP_401_UNAUTHORIZED)
-        
\ No newline at end of file
+
+
+class CountStrategyPaginatorTestCase(TestCase):
+    
+    # Закэшированное кол-во устаревает при изменении поколения модели
+    cached_count = {'count_strategy': 'cached', 'get_count_version': get_generation}
+    
+    def setUp(self):
+        cache.clear()
+        for i in range(3):
+            Events.objects.create(
+                name=f'Test event {i}',
+                start_datetime=timezone.now() + timedelta(days=1),
+                closing_registration_date=timezone.now() + timedelta(hours=1)
+            )
+        
+    def tearDown(self):
+        cache.clear()
+    
+    @override_settings(PAGINATION_COUNT_STRATEGY='exact')
+    def test_exact_count(self):
+        paginator = CountStrategyPaginator(Events.objects.all(), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_is_exact)
+    
+    @override_settings(PAGINATION_COUNT_STRATEGY='cached')
+    def test_cached_count_without_version(self):
+        # Без версии кэша (например, список пользователей) кол-во не кэшируется
+        CountStrategyPaginator(Events.objects.all(), 2).count
+        with self.assertNumQueries(1):
+            paginator = CountStrategyPaginator(Events.objects.all(), 2)
+            self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_is_exact)
+    
+    def test_cached_count(self):
+        paginator = CountStrategyPaginator(Events.objects.filter(name__icontains='test'), 2, **self.cached_count)
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.count_is_exact)
+        
+        with CaptureQueriesContext(connection) as queries:
+            paginator = CountStrategyPaginator(Events.objects.filter(name__icontains='test'), 2, **self.cached_count)
+            self.assertEqual(paginator.count, 3)
+        self.assertEqual(len(queries), 0)
+        self.assertTrue(paginator.count_is_exact)
+        
+        # Другие фильтры кэшируются отдельно
+        paginator = CountStrategyPaginator(Events.objects.filter(name='Test event 1'), 2, **self.cached_count)
+        self.assertEqual(paginator.count, 1)
+        
+        # Изменение модели инвалидирует закэшированное кол-во
+        Events.objects.first().delete()
+        paginator = CountStrategyPaginator(Events.objects.filter(name__icontains='test'), 2, **self.cached_count)
+        self.assertEqual(paginator.count, 2)
+        self.assertEqual(CountStrategyPaginator(Events.objects.none(), 2, **self.cached_count).count, 0)
+    
+    @override_settings(PAGINATION_COUNT_STRATEGY='estimated')
+    def test_inexact_count_does_not_truncate_pages(self):
+        for i in range(3, 6):
+            Events.objects.create(
+                name=f'Test event {i}',
+                start_datetime=timezone.now() + timedelta(days=1),
+                closing_registration_date=timezone.now() + timedelta(hours=1)
+            )
+        
+        # Оценка кол-ва устарела
+        with mock.patch.object(CountStrategyPaginator, 'get_estimated_count', return_value=3):
+            paginator = CountStrategyPaginator(Events.objects.all(), 2)
+            self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.count_is_exact)
+        
+        page = paginator.page(2)
+        self.assertEqual(len(page.object_list), 2)
+        self.assertTrue(page.has_next())
+        page = paginator.page(3)
+        self.assertEqual(len(page.object_list), 2)
+        self.assertFalse(page.has_next())
+    
+    def test_view_count_strategy(self):
+        # Списки мероприятий (CachedModelMixin) кэшируют кол-во по поколению модели, такое кол-во точное
+        first_page = self.client.get(reverse('events-list'), {'page_size': 2})
+        with CaptureQueriesContext(connection) as queries:
+            second_page = self.client.get(reverse('events-list'), {'page_size': 2, 'page': 2})
+        self.assertTrue(first_page.data.get('count_is_exact'))
+        self.assertTrue(second_page.data.get('count_is_exact'))
+        self.assertEqual(second_page.data.get('count'), 3)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        
+        # Оценка кол-ва из настроек используется и для списков мероприятий (страница не из кэша)
+        with override_settings(PAGINATION_COUNT_STRATEGY='estimated'), \
+             mock.patch.object(CountStrategyPaginator, 'get_estimated_count', return_value=1000000):
+            response = self.client.get(reverse('events-list'), {'page_size': 1})
+        self.assertEqual(response.data.get('count'), 1000000)
+        self.assertFalse(response.data.get('count_is_exact'))
+    
+    @override_settings(PAGINATION_COUNT_STRATEGY='estimated', PAGINATION_COUNT_ESTIMATE_THRESHOLD=0)
+    def test_estimated_count(self):
+        if connection.vendor != 'postgresql':
+            # Оценка доступна только в Postgres, для остальных бд используется COUNT(*)
+            self.assertEqual(CountStrategyPaginator(Events.objects.all(), 2).count, 3)
+            return
+        
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Events._meta.db_table}")
+        paginator = CountStrategyPaginator(Events.objects.all(), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.count_is_exact)
+        
+        # Для списков с фильтрами оценка не используется
+        paginator = CountStrategyPaginator(Events.objects.filter(name='Test event 1'), 2)
+        self.assertEqual(paginator.count, 1)
+        self.assertTrue(paginator.count_is_exact)
+
+
+class FakeQiwiNotifier:
+    """ Sends signed QIWI bill status notifications to the API """
+    
+    def __init__(self, client, secret_key):
+        self.client = client
+        self.secret_key = secret_key
+    
+    def notify(self, registration, payment_status, amount, secret_key=None):
+        bill = {
+            "siteId": "test-site",
+            "billId": registration.shortuuid,
+            "amount": {"value": amount, "currency": "RUB"},
+            "status": {"value": payment_status, "changedDateTime": timezone.now().isoformat()},
+        }
+        signature = get_QIWI_notification_signature(bill, secret_key or self.secret_key)
+        return self.client.post(
+            reverse('qiwi-notifications'), {"bill": bill, "version": "1"}, 
+            format='json', HTTP_X_API_SIGNATURE_SHA256=signature
+        )
+
+
+@override_settings(QIWI_PRIVATE_KEY='test-secret-key')
+class QiwiNotificationViewTestCase(APITestCase):
+    
+    payment_statuses = PaidEventRegistrations.PaymentStatuses
+    
+    def setUp(self):
+        self.notifier = FakeQiwiNotifier(APIClient(), 'test-secret-key')
+        self.user = get_user_model().objects.create(
+            username='user@test.com',
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.paid_event = PaidEvents.objects.create(
+            name='Test paid event',
+            price=100,
+            start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        self.registration = PaidEventRegistrations.objects.create(event=self.paid_event, user=self.user)
+    
+    def tearDown(self):
+        self.user.delete()
+    
+    def test_paid_notification(self):
+        response = self.notifier.notify(self.registration, self.payment_statuses.WAITING, "100.00")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.registration.refresh_from_db()
+        self.assertEqual(self.registration.payment_status, self.payment_statuses.WAITING)
+        
+        response = self.notifier.notify(self.registration, self.payment_statuses.PAID, "100.00")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"error": "0"})
+        self.registration.refresh_from_db()
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.registration.payment_status, self.payment_statuses.PAID)
+        self.assertTrue(self.registration.is_registration_confirmed)
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 1)
+        
+        # Повторные и устаревшие уведомления не изменяют регистрацию
+        for payment_status in (self.payment_statuses.PAID, self.payment_statuses.WAITING, self.payment_statuses.EXPIRED):
+            response = self.notifier.notify(self.registration, payment_status, "100.00")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.registration.refresh_from_db()
+        self.paid_event.refresh_from_db()
+        self.assertEqual(self.registration.payment_status, self.payment_statuses.PAID)
+        self.assertEqual(self.paid_event.confirmed_visitors_count, 1)
+    
+    def test_unpaid_notification_promotes_waitlist(self):
+        PaidEvents.objects.filter(pk=self.paid_event.pk).update(max_visitors=1)
+        waitlisted_users = [
+            get_user_model().objects.create(username=f'waitlisted{i}@test.com', email=f'waitlisted{i}@test.com')
+            for i in range(2)
+        ]
+        waitlisted = [
+            PaidEventRegistrations.objects.create(event=self.paid_event, user=user, waitlist_position=position)
+            for position, user in enumerate(waitlisted_users, start=1)
+        ]
+        
+        # Каждый закрытый без оплаты счет освобождает место для следующего в листе ожидания
+        for registration, next_registration, payment_status, remaining_waitlist in (
+            (self.registration, waitlisted[0], self.payment_statuses.EXPIRED, 1),
+            (waitlisted[0], waitlisted[1], self.payment_statuses.REJECTED, 0),
+        ):
+            with self.subTest(payment_status=payment_status):
+                response = self.notifier.notify(registration, payment_status, "100.00")
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                next_registration.refresh_from_db()
+                self.assertIsNone(next_registration.waitlist_position)
+                self.assertEqual(
+                    PaidEventRegistrations.objects.filter(event=self.paid_event, waitlist_position__isnull=False).count(),
+                    remaining_waitlist
+                )
+    
+    def test_invalid_notifications(self):
+        response = self.notifier.notify(self.registration, self.payment_statuses.PAID, "100.00", secret_key='wrong-key')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        response = self.notifier.client.post(reverse('qiwi-notifications'), {"version": "1"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        response = self.notifier.notify(self.registration, self.payment_statuses.PAID, "1.00")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        self.registration.refresh_from_db()
+        self.assertEqual(self.registration.payment_status, self.payment_statuses.CREATED)
+        self.assertFalse(self.registration.is_registration_confirmed)
+
+
+class PaymentRegistrationModelMixinTestCase(APITestCase):
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create(
+            username='user@test.com',
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        
+        self.paid_event = PaidEvents.objects.create(
+            name='Test paid event',
+            price=100,
+            start_datetime=timezone.now() + timedelta(days=1),
+            closing_registration_date=timezone.now() + timedelta(hours=1)
+        )
+        self.event_registration_url = reverse('paidevents-registration', args=[self.paid_event.id])
+        FakePaymentProvider.reset()
+    
+    def tearDown(self):
+        self.user.delete()
+        FakePaymentProvider.reset()
+    
+    def test_event_registration_view(self):
+        response = self.client.post(self.event_registration_url)
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNotNone(response.data.get("payment_link"))
+        self.assertEqual(list(FakePaymentProvider.bills), [response.data.get("shortuuid")])
+    
+    @override_settings(PAYMENT_BILL_CREATION_ASYNC=True)
+    def test_async_event_registration_view(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.event_registration_url)
+        
+        # Счет создается после ответа пользователю
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIsNone(response.data.get("payment_link"))
+        self.assertIsNone(response.data.get("waitlist_position"))
+        self.assertEqual(FakePaymentProvider.bills, {})
+        
+        registration = PaidEventRegistrations.objects.get(shortuuid=response.data.get("shortuuid"))
+        self.assertEqual(
+            list(OutboxMessages.objects.filter(task_name=create_registration_bill.name).values_list('kwargs', flat=True)),
+            [{'registration_id': registration.pk}]
+        )
+        
+        response = self.client.get(self.event_registration_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data.get("payment_link"))
+        
+        create_registration_bill(registration.pk)
+        
+        response = self.client.get(self.event_registration_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data.get("payment_link"))
+    
+    def test_get_not_exsisting_registration(self):
+        response = self.client.get(self.event_registration_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,13 +1,16 @@
-from django.conf import settings
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
-from rest_framework import viewsets
-from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework import status, viewsets
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from config.permissions import ReadOnly, ReadOnlyIfAuthenticated
+from config.qiwi import is_valid_QIWI_notification
 
-from .mixins import (PaymentRegistrationModelMixin,
+from .mixins import (CachedModelMixin, PaymentRegistrationModelMixin,
                      PrivateInvitationModelMixin, RegistrationModelMixin)
 from .models import (EventRegistrations, Events, EventTypes, EventVenues,
                      PaidEventRegistrations, PaidEvents,
@@ -19,16 +22,41 @@ from .serializers import (EventRegistrationsSerializer, EventsSerializer,
                           PrivateEventRegistrationsSerializer,
                           PrivateEventsSerializer)
 
-# Кэшируются только GET и HEAD ответы со статусом 200
-default_decorators = (cache_page(getattr(settings, 'CACHING_TIME', 60)), vary_on_headers("Authorization",))
+# Подтвержденные регистрации подгружаются одним запросом на всю страницу
+
+confirmed_event_registrations = Prefetch(
+    'eventregistrations_set',
+    queryset=EventRegistrations.objects.filter(
+        is_registration_confirmed=True
+    ).order_by('-id'),
+    to_attr='confirmed_registrations'
+)
+
+confirmed_private_event_registrations = Prefetch(
+    'privateeventregistrations_set',
+    queryset=PrivateEventRegistrations.objects.filter(
+        is_registration_confirmed=True
+    ).order_by('-id'),
+    to_attr='confirmed_registrations'
+)
+
+confirmed_paid_event_registrations = Prefetch(
+    'paideventregistrations_set',
+    queryset=PaidEventRegistrations.objects.filter(
+        is_registration_confirmed=True,
+        payment_status=PaidEventRegistrations.PaymentStatuses.PAID
+    ).order_by('-id'),
+    to_attr='confirmed_registrations'
+)
 
 
 # ViewSets
 
 
-@method_decorator(default_decorators, name="dispatch")
-class EventsViewSet(viewsets.ModelViewSet, RegistrationModelMixin):
-    queryset = Events.objects.all()
+class EventsViewSet(RegistrationModelMixin, CachedModelMixin, viewsets.ModelViewSet):
+    queryset = Events.objects.select_related('venue', 'category').prefetch_related(
+        confirmed_event_registrations
+    )
     serializer_class = EventsSerializer
     permission_classes = [ReadOnly | IsAdminUser, ]
     
@@ -45,9 +73,10 @@ class EventsViewSet(viewsets.ModelViewSet, RegistrationModelMixin):
     event_registration_model = EventRegistrations
 
 
-@method_decorator(default_decorators, name="dispatch")
-class PrivateEventsViewSet(viewsets.ModelViewSet, PrivateInvitationModelMixin):
-    queryset = PrivateEvents.objects.all()
+class PrivateEventsViewSet(PrivateInvitationModelMixin, CachedModelMixin, viewsets.ModelViewSet):
+    queryset = PrivateEvents.objects.select_related('venue', 'category').prefetch_related(
+        confirmed_private_event_registrations
+    )
     serializer_class = PrivateEventsSerializer
     permission_classes = [ReadOnlyIfAuthenticated | IsAdminUser, ]
     
@@ -57,9 +86,10 @@ class PrivateEventsViewSet(viewsets.ModelViewSet, PrivateInvitationModelMixin):
     event_registration_model = PrivateEventRegistrations
 
 
-@method_decorator(default_decorators, name="dispatch")
-class PaidEventsViewSet(viewsets.ModelViewSet, PaymentRegistrationModelMixin, PrivateInvitationModelMixin):
-    queryset = PaidEvents.objects.all()
+class PaidEventsViewSet(PaymentRegistrationModelMixin, PrivateInvitationModelMixin, CachedModelMixin, viewsets.ModelViewSet):
+    queryset = PaidEvents.objects.select_related('venue', 'category').prefetch_related(
+        confirmed_paid_event_registrations
+    )
     serializer_class = PaidEventsSerializer
     permission_classes = [ReadOnlyIfAuthenticated | IsAdminUser, ]
 
@@ -70,8 +100,7 @@ class PaidEventsViewSet(viewsets.ModelViewSet, PaymentRegistrationModelMixin, Pr
     event_registration_model = PaidEventRegistrations
 
 
-@method_decorator(default_decorators, name="dispatch")
-class EventVenuesViewSet(viewsets.ModelViewSet):
+class EventVenuesViewSet(CachedModelMixin, viewsets.ModelViewSet):
     queryset = EventVenues.objects.all()
     serializer_class = EventVenuesSerializer
     permission_classes = [ReadOnly | IsAdminUser, ]
@@ -84,8 +113,7 @@ class EventVenuesViewSet(viewsets.ModelViewSet):
     }
 
 
-@method_decorator(default_decorators, name="dispatch")
-class EventTypesViewSet(viewsets.ModelViewSet):
+class EventTypesViewSet(CachedModelMixin, viewsets.ModelViewSet):
     queryset = EventTypes.objects.all()
     serializer_class = EventTypesSerializer
     permission_classes = [ReadOnly | IsAdminUser, ]
@@ -93,3 +121,50 @@ class EventTypesViewSet(viewsets.ModelViewSet):
     filterset_fields = {
         'name': ['iexact', 'icontains'],
     }
+
+
+class QiwiNotificationView(APIView):
+    """ Receives QIWI bill status notifications.
+    
+    Notifications are verified by X-Api-Signature-SHA256 header and applied
+    idempotently, payment_handler task polls QIWI only as a safety net """
+    
+    authentication_classes = []
+    permission_classes = [AllowAny, ]
+    
+    payment_statuses = PaidEventRegistrations.PaymentStatuses
+    
+    # Статусы, из которых регистрация может перейти в новый статус оплаты
+    pending_payment_statuses = {
+        payment_statuses.CREATED: (payment_statuses.WAITING, payment_statuses.PAID, payment_statuses.REJECTED, payment_statuses.EXPIRED),
+        payment_statuses.WAITING: (payment_statuses.PAID, payment_statuses.REJECTED, payment_statuses.EXPIRED),
+    }
+    
+    def post(self, request, *args, **kwargs):
+        bill = request.data.get("bill") if isinstance(request.data, dict) else None
+        if not isinstance(bill, dict) or not is_valid_QIWI_notification(bill, request.headers.get("X-Api-Signature-SHA256")):
+            return Response({"error": "Неверная подпись уведомления"}, status=status.HTTP_403_FORBIDDEN)
+        
+        payment_status = bill["status"]["value"]
+        with transaction.atomic():
+            registration = PaidEventRegistrations.objects.select_for_update().select_related('event').filter(
+                shortuuid=bill["billId"], waitlist_position__isnull=True
+            ).first()
+            
+            # Повторные и устаревшие уведомления не изменяют регистрацию
+            if registration is None or payment_status not in self.pending_payment_statuses.get(registration.payment_status, ()):
+                return Response({"error": "0"})
+            
+            if payment_status == self.payment_statuses.PAID:
+                try:
+                    amount = Decimal(str(bill["amount"]["value"]))
+                except InvalidOperation:
+                    amount = None
+                if amount != registration.event.price:
+                    return Response({"error": "Сумма оплаты не совпадает с ценой мероприятия"}, status=status.HTTP_400_BAD_REQUEST)
+                registration.is_registration_confirmed = True
+            
+            registration.payment_status = payment_status
+            registration.save()
+        
+        return Response({"error": "0"})